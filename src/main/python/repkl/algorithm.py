@@ -26,14 +26,22 @@
 import pathlib
 import typing
 import enum
+import io
 import xml.etree.ElementTree as ET
 import logging
 import uuid
-import shutil
+import dataclasses
+import heapq
+import time
+import concurrent.futures
 
 import repkl.assetmap
 import repkl.pkl
 import repkl.cpl
+import repkl.storage
+import repkl.digest
+import repkl.index
+import repkl.utils
 
 CREATOR_STRING = "repkl"
 
@@ -47,124 +55,570 @@ class Action(enum.Enum):
   SKIP = "skip"           # skip writing assets and only write the new PackingList and AssetMap
   SYMLINK = "symlink"     # create symlinks to assets
 
-ASSETMAP_FILENAME = "ASSETMAP.xml"
+ASSETMAP_FILENAME = repkl.assetmap.ASSETMAP_FILENAME
+
+StorageLocation = typing.Union[pathlib.Path, str, repkl.storage.Storage]
+FileLocation = typing.Union[pathlib.Path, str]
+
+@dataclasses.dataclass(frozen=True)
+class SourceCandidate:
+  storage: repkl.storage.Storage
+  am_asset: repkl.assetmap.Asset
+  pkl_asset: typing.Optional[repkl.pkl.Asset]
+
+def _check_candidates(asset_id: str, candidates: typing.List[SourceCandidate]):
+  # all copies of an asset must be described identically by their PackingLists
+
+  described = [c for c in candidates if c.pkl_asset is not None]
+
+  for c in described[1:]:
+    ref = described[0].pkl_asset
+    if c.pkl_asset.size != ref.size or (c.pkl_asset.hash_algorithm == ref.hash_algorithm and c.pkl_asset.hash != ref.hash):
+      raise ValueError(f"Asset {asset_id} is described differently in {described[0].storage} and {c.storage}")
+
+def _select_source(candidates: typing.List[SourceCandidate],
+                   dest_devices: typing.AbstractSet[int],
+                   fast_devices: typing.List[int]) -> typing.Tuple[SourceCandidate, str]:
+  # prefers, in order, copies that are present with the expected size, that are on the same
+  # device as the destination (so that they can be renamed or cloned), that are on the fastest
+  # known devices, and that are local
+
+  def _rank(c: SourceCandidate) -> typing.Tuple[typing.Tuple[int, ...], str]:
+    try:
+      size = c.storage.size(c.am_asset.path)
+      device = c.storage.device(c.am_asset.path)
+    except OSError:
+      return ((3, 0, 0), "missing")
+
+    mismatch = 1 if c.pkl_asset is not None and size != c.pkl_asset.size else 0
+    reason = "size mismatch, " if mismatch else ""
+
+    if device is None:
+      return ((mismatch, 3, 0), reason + "remote")
+    if device in dest_devices:
+      return ((mismatch, 0, 0), reason + "same device as destination")
+    if device in fast_devices:
+      return ((mismatch, 1, fast_devices.index(device)), reason + "fast device")
+    return ((mismatch, 2, 0), reason + "local device")
+
+  ranked = sorted(((_rank(c), i) for i, c in enumerate(candidates)))
+  (_, reason), i = ranked[0]
+
+  return (candidates[i], reason)
+
+def assign_volumes(sizes: typing.Mapping[str, int], volume_count: int) -> typing.Dict[str, int]:
+  """Assigns each asset, identified by its id in `sizes`, to one of `volume_count` volumes, numbered
+  from 1, so that the volumes hold approximately the same number of bytes. Assets are assigned,
+  largest first, to the least filled volume."""
+
+  volumes = [(0, v) for v in range(1, volume_count + 1)]
+  assignment = {}
+
+  for asset_id in sorted(sizes, key=lambda i: (-sizes[i], i)):
+    total, v = heapq.heappop(volumes)
+    assignment[asset_id] = v
+    heapq.heappush(volumes, (total + sizes[asset_id], v))
+
+  return assignment
+
+def _leaf_storages(storage: repkl.storage.Storage) -> typing.List[repkl.storage.Storage]:
+  if isinstance(storage, repkl.storage.FanOutStorage):
+    return storage.storages
+  return [storage]
+
+def _transfer_asset(dest: repkl.storage.Storage,
+                    source: SourceCandidate,
+                    pkl_asset: repkl.pkl.Asset,
+                    action: Action,
+                    digest_cache: typing.Optional[repkl.digest.DigestCache],
+                    digest_algorithms: typing.Collection[str] = (),
+                    allow_size_mismatch: bool = False) -> typing.Dict[str, str]:
+  # returns the digests of the asset for `digest_algorithms`, which are computed while the asset is copied
+
+  src = source.storage
+  src_path = source.am_asset.path
+  dst_path = source.am_asset.path
+
+  if action == Action.COPY:
+    LOGGER.info("Copying %s to %s", src_path, dest)
+
+    # the size is needed upfront by streaming destinations, and must match both the source, e.g. every part
+    # of an HTTP download, and the PackingList
+    size = src.size(src_path)
+    if size != pkl_asset.size:
+      if not allow_size_mismatch:
+        raise ValueError(f"{src_path} in {src} is {size} bytes but its PackingList size is {pkl_asset.size} bytes")
+      LOGGER.warning("%s is %s bytes but its PackingList size is %s bytes", src_path, size, pkl_asset.size)
+
+    if len(digest_algorithms) > 0 and isinstance(src, repkl.storage.LocalStorage):
+      src_stat = src.path(src_path).stat()
+
+    digests = dest.put_file(dst_path, src, src_path, size, digest_algorithms)
+
+    if digest_cache is not None and isinstance(src, repkl.storage.LocalStorage):
+      for algorithm, digest in digests.items():
+        digest_cache.put(src.path(src_path), algorithm, digest, src_stat)
+
+      # copies inherit the cached digests of their source
+      for d in _leaf_storages(dest):
+        if isinstance(d, repkl.storage.LocalStorage):
+          digest_cache.copy(src.path(src_path), d.path(dst_path))
+
+    return digests
+
+  if action == Action.MOVE:
+    LOGGER.info("Moving %s to %s", src_path, dest)
+    dest.move_file(dst_path, src, src_path)
+  elif action == Action.SYMLINK:
+    LOGGER.info("Symlink from %s to %s", src_path, dest)
+    dest.symlink_file(dst_path, src, src_path)
+  else:
+    LOGGER.info("Skipping copying %s to %s", src_path, dest)
+
+  return {}
+
+def _compute_digests(sources: typing.Mapping[str, SourceCandidate],
+                     algorithm: str,
+                     digest_cache: typing.Optional[repkl.digest.DigestCache]) -> typing.Dict[str, str]:
+  # local files are hashed in parallel across processes, while remote files are hashed as they are read
+
+  digests: typing.Dict[str, str] = {}
 
-def process(target_cpl_path: pathlib.Path,
-            dest_dir_path: pathlib.Path,
+  local_sources = {i: c for i, c in sources.items() if isinstance(c.storage, repkl.storage.LocalStorage)}
+
+  if len(local_sources) == 0:
+    executor = None
+  else:
+    executor = concurrent.futures.ProcessPoolExecutor()
+
+  try:
+    stats = {}
+    futures = {}
+    for i, c in local_sources.items():
+      path = c.storage.path(c.am_asset.path)
+      stats[i] = path.stat()
+      futures[i] = executor.submit(repkl.digest.compute_digest, path, algorithm)
+
+    for i, c in sources.items():
+      if i not in local_sources:
+        digests[i] = c.storage.digest(c.am_asset.path, algorithm)
+
+    for i, f in futures.items():
+      digests[i] = f.result()
+      if digest_cache is not None:
+        digest_cache.put(local_sources[i].storage.path(local_sources[i].am_asset.path), algorithm, digests[i], stats[i])
+  finally:
+    if executor is not None:
+      executor.shutdown()
+
+  return digests
+
+def _close_storages(storages: typing.Iterable[repkl.storage.Storage], abort: bool = False):
+  # every storage is closed, or aborted, even if closing another one fails
+
+  error = None
+
+  for s in storages:
+    try:
+      if abort:
+        s.abort()
+      else:
+        s.close()
+    except Exception as e: # pylint: disable=broad-except
+      if error is None:
+        error = e
+
+  if error is not None:
+    raise error
+
+def _serialize(doc: typing.Union[repkl.pkl.PackingList, repkl.assetmap.AssetMap, repkl.assetmap.VolumeIndex]) -> bytes:
+  buf = io.BytesIO()
+  doc.write(buf)
+  return buf.getvalue()
+
+def process(target_cpl_path: FileLocation,
+            dest_dir_path: typing.Union[StorageLocation, typing.List[StorageLocation]],
             action: Action,
-            base_cpl_path: typing.Optional[pathlib.Path] = None,
-            mapped_file_set_paths: typing.Optional[typing.List[pathlib.Path]] = None
+            base_cpl_path: typing.Optional[FileLocation] = None,
+            mapped_file_set_paths: typing.Optional[typing.List[StorageLocation]] = None,
+            storage_options: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+            fast_device_paths: typing.Optional[typing.List[pathlib.Path]] = None,
+            verify: bool = False,
+            digest_cache: typing.Optional[repkl.digest.DigestCache] = None,
+            index: typing.Optional[repkl.index.AssetIndex] = None,
+            extra_volume_paths: typing.Optional[typing.List[StorageLocation]] = None,
+            durability: repkl.storage.Durability = repkl.storage.Durability.NONE,
+            hash_algorithm: typing.Optional[str] = None,
+            append: bool = False,
+            allow_size_mismatch: bool = False
   ):
 
-  # collect all mapped file sets
+  # locations are either local paths, s3:// URLs or Storage instances
 
-  if mapped_file_set_paths is not None and len(mapped_file_set_paths) > 0:
-    # use the provided mapped file sets
-    am_dir_paths = {e.resolve() for e in mapped_file_set_paths}
+  storage_options = storage_options if storage_options is not None else {}
 
-  else:
-    # infer mapped file sets from CPL paths
-    LOGGER.info("Inferring mapped file sets from input CPL paths")
+  dest_locations = dest_dir_path if isinstance(dest_dir_path, list) else [dest_dir_path]
+  extra_volume_locations = extra_volume_paths if extra_volume_paths is not None else []
 
-    am_dir_paths = set()
-    am_dir_paths.add(target_cpl_path.parent.resolve())
-    if base_cpl_path is not None:
-      am_dir_paths.add(base_cpl_path.parent.resolve())
+  if len(dest_locations) > 1:
+    if len(extra_volume_locations) > 0:
+      raise ValueError("Multi-volume Mapped File Sets cannot be written to multiple destinations")
+    if action == Action.MOVE:
+      raise ValueError("Assets cannot be moved to multiple destinations")
 
-  # collect all assets
+  if append and len(dest_locations) + len(extra_volume_locations) > 1:
+    raise ValueError("Assets can only be appended to a single destination")
 
-  path_resolver: typing.Mapping[str, pathlib.Path] = {}
-  pkl_asset_resolver: typing.Mapping[str, repkl.pkl.Asset] = {}
-  am_asset_resolver: typing.Mapping[str, repkl.assetmap.Asset] = {}
+  # storages are closed once processing ends, whether or not it succeeds, so that destinations are
+  # synced and tar archives are finished
 
-  for p in am_dir_paths:
-    am_doc = ET.parse(p.joinpath(ASSETMAP_FILENAME))
-    am = repkl.assetmap.AssetMap.from_element(am_doc.getroot())
+  dests: typing.List[repkl.storage.Storage] = []
+  volumes: typing.List[repkl.storage.Storage] = []
+  cpl_storages: typing.Set[repkl.storage.Storage] = set()
+  am_dirs: typing.Set[repkl.storage.Storage] = set()
+  index_roots: typing.Dict[str, repkl.storage.Storage] = {}
+  succeeded = False
 
-    # TODO: detect duplicates
-    am_asset_resolver.update({a.id: a for a in am.assets})
-    path_resolver.update({a.id : p.joinpath(a.path) for a in am.assets})
+  try:
+    # identical Mapped File Sets are written to all destinations
 
-    for pkl_entry in filter(lambda x: x.is_pkl, am.assets):
-      pkl_doc = ET.parse(p.joinpath(pkl_entry.path))
-      pkl = repkl.pkl.PackingList.from_element(pkl_doc.getroot())
+    dests.extend(repkl.storage.open_storage(e, durability, **storage_options) for e in dest_locations)
 
-      # TODO: detect duplicates
-      pkl_asset_resolver.update({a.id: a for a in pkl.assets})
+    dest = repkl.storage.FanOutStorage(dests) if len(dests) > 1 else dests[0]
 
-  # collect assets for the Target
+    # the destination is the first volume of the new Mapped File Set
 
-  target_cpl = repkl.cpl.Composition.from_element(ET.parse(target_cpl_path).getroot())
-  target_asset_ids = set()
-  target_asset_ids.add(target_cpl.id)
-  target_asset_ids.update(target_cpl.resource_ids)
+    volumes.append(dest)
+    volumes.extend(repkl.storage.open_storage(e, durability, **storage_options) for e in extra_volume_locations)
 
-  # subtract assets already present in the base
+    if any(d.read_only for d in dests + volumes):
+      raise ValueError("Mapped File Sets cannot be written to read-only destinations")
 
-  if base_cpl_path is not None:
-    base_cpl = repkl.cpl.Composition.from_element(ET.parse(base_cpl_path).getroot())
-    target_asset_ids = target_asset_ids.difference(base_cpl.resource_ids)
+    # in append mode, the destination is an existing Mapped File Set whose assets are neither transferred
+    # nor overwritten, and whose AssetMap is updated
 
+    if append:
+      existing_am = repkl.assetmap.AssetMap.from_element(ET.fromstring(dest.read_bytes(ASSETMAP_FILENAME)))
+      if existing_am.volume_count > 1:
+        raise ValueError("Assets cannot be appended to a multi-volume Mapped File Set")
+    else:
+      existing_am = None
 
-  # create PKL for the Target
+    target_cpl_storage, target_cpl_fn = repkl.storage.open_file_location(target_cpl_path, **storage_options)
+    cpl_storages = {target_cpl_storage}
+    if base_cpl_path is not None:
+      base_cpl_storage, base_cpl_fn = repkl.storage.open_file_location(base_cpl_path, **storage_options)
+      cpl_storages.add(base_cpl_storage)
 
-  target_pkl = repkl.pkl.PackingList(
-    assets=[pkl_asset_resolver[i] for i in target_asset_ids],
-    creator=CREATOR_STRING,
-    issuer=target_cpl.issuer,
-    issuer_lang=target_cpl.issuer_lang,
-    annotation=target_cpl.content_title,
-    annotation_lang=target_cpl.content_title_lang
-  )
+    # collect all mapped file sets
 
-  pkl_fn = f"PKL_{str(uuid.UUID(target_pkl.id))}.xml"
+    if mapped_file_set_paths is not None and len(mapped_file_set_paths) > 0:
+      # use the provided mapped file sets
+      am_dirs = {repkl.storage.open_storage(e, **storage_options) for e in mapped_file_set_paths}
 
-  if action != Action.DRYRUN:
-    target_pkl.write(dest_dir_path.joinpath(pkl_fn))
+    elif index is not None:
+      # assets are located using the index
+      am_dirs = set()
 
-  LOGGER.info("Target PackingList written (%s)", pkl_fn)
+    else:
+      # infer mapped file sets from CPL paths
+      LOGGER.info("Inferring mapped file sets from input CPL paths")
 
-  # build Asset Map for the Target
+      am_dirs = set()
+      am_dirs.add(target_cpl_storage)
+      if base_cpl_path is not None:
+        am_dirs.add(base_cpl_storage)
 
-  target_am = repkl.assetmap.AssetMap(
-    assets=[am_asset_resolver[i] for i in target_asset_ids],
-    creator=CREATOR_STRING,
-    issuer=target_cpl.issuer,
-    issuer_lang=target_cpl.issuer_lang,
-    annotation=target_cpl.content_title,
-    annotation_lang=target_cpl.content_title_lang
-  )
+    # collect all copies of all assets
 
-  target_am.assets.append(repkl.assetmap.Asset(
-    id=target_pkl.id,
-    path=pkl_fn,
-    is_pkl=True
-  ))
+    candidate_resolver: typing.Dict[str, typing.List[SourceCandidate]] = {}
+
+    pkl_assets: typing.Dict[str, repkl.pkl.Asset] = {}
+
+    for p in am_dirs:
+      for am_asset, pkl_asset in repkl.index.scan_mapped_file_set(p, pkl_assets):
+        candidate_resolver.setdefault(am_asset.id, []).append(SourceCandidate(p, am_asset, pkl_asset))
+
+    existing_assets: typing.Dict[str, SourceCandidate] = {}
+
+    if existing_am is not None:
+      for am_asset, pkl_asset in repkl.index.scan_mapped_file_set(dest, pkl_assets):
+        existing_assets[am_asset.id] = SourceCandidate(dest, am_asset, pkl_asset)
+
+    def _index_candidates(asset_id: str) -> typing.List[SourceCandidate]:
+      candidates = []
+      for r in index.lookup(asset_id):
+        if r.root not in index_roots:
+          index_roots[r.root] = repkl.storage.open_storage(r.root, **storage_options)
+        storage = index_roots[r.root]
+        if storage not in am_dirs:
+          candidates.append(SourceCandidate(storage, r.am_asset, r.pkl_asset))
+      return candidates
+
+    # collect assets for the Target
+
+    target_cpl = repkl.cpl.load_composition(target_cpl_storage, target_cpl_fn)
+    target_asset_ids = set()
+    target_asset_ids.add(target_cpl.id)
+    target_asset_ids.update(target_cpl.resource_ids)
+
+    # subtract assets already present in the base
+
+    if base_cpl_path is not None:
+      base_cpl = repkl.cpl.load_composition(base_cpl_storage, base_cpl_fn)
+      target_asset_ids = target_asset_ids.difference(base_cpl.resource_ids)
+
+    # select the source of each asset of the Target
+
+    dest_devices = {v.device("") for v in volumes + dests} if action in (Action.COPY, Action.MOVE) else set()
+    fast_devices = [p.stat().st_dev for p in fast_device_paths] if fast_device_paths is not None else []
+
+    sources: typing.Dict[str, SourceCandidate] = {}
+    pkl_asset_resolver: typing.Dict[str, repkl.pkl.Asset] = {}
+
+    for i in target_asset_ids:
+      candidates = candidate_resolver.get(i, [])
+      if index is not None:
+        candidates = candidates + _index_candidates(i)
+
+      if i in existing_assets:
+        candidates = [existing_assets[i]] + [c for c in candidates if c.storage != dest]
+        _check_candidates(i, candidates)
+        source, reason = (existing_assets[i], "already present")
+      else:
+        if len(candidates) == 0:
+          raise ValueError(f"Asset {i} is not present in any mapped file set")
+
+        _check_candidates(i, candidates)
+
+        if len(candidates) > 1:
+          source, reason = _select_source(candidates, dest_devices, fast_devices)
+        else:
+          source, reason = (candidates[0], "only copy")
+      sources[i] = source
+
+      # assets of multi-volume Mapped File Sets can be stored on a different volume than their PackingList
+      pkl_asset = source.pkl_asset or next((c.pkl_asset for c in candidates if c.pkl_asset is not None), pkl_assets.get(i))
+      if pkl_asset is None:
+        raise ValueError(f"Asset {i} is not listed in any PackingList")
+      pkl_asset_resolver[i] = pkl_asset
+
+      LOGGER.info("Source of %s: %s (%s, %d candidate(s))", source.am_asset.path, source.storage, reason, len(candidates))
+
+    if existing_am is not None:
+      existing_paths = {a.path for a in existing_am.assets}
+      for i in target_asset_ids.difference(existing_assets):
+        if sources[i].am_asset.path in existing_paths:
+          raise ValueError(f"{sources[i].am_asset.path} is already present in {dest} as a different asset")
+
+    # verify the sources against their PackingList hashes, using cached digests where available
+    # and otherwise while the assets are copied, so that each asset is read once
+
+    verified_on_copy: typing.Set[str] = set()
+    mismatches = 0
+
+    if verify:
+      for i in target_asset_ids.difference(existing_assets):
+        source = sources[i]
+        pkl_asset = pkl_asset_resolver[i]
+
+        size = source.storage.size(source.am_asset.path)
+        if size != pkl_asset.size:
+          LOGGER.error("%s in %s is %s bytes but its PackingList size is %s bytes",
+                       source.am_asset.path, source.storage, size, pkl_asset.size)
+          mismatches += 1
+          continue
+
+        digest = source.storage.cached_digest(source.am_asset.path, pkl_asset.hash_algorithm, digest_cache)
+
+        if digest is None:
+          if action == Action.COPY:
+            verified_on_copy.add(i)
+            continue
+          digest = source.storage.digest(source.am_asset.path, pkl_asset.hash_algorithm, digest_cache)
+
+        if digest != pkl_asset.hash:
+          LOGGER.error("Hash of %s in %s does not match its PackingList", source.am_asset.path, source.storage)
+          mismatches += 1
+        else:
+          LOGGER.info("Verified %s", source.am_asset.path)
+
+      if mismatches > 0:
+        raise ValueError(f"{mismatches} asset(s) do not match their PackingList size or hash")
+
+    # digests of the new PackingList, using cached digests where available and otherwise computed while
+    # the assets are copied or, for other actions, in parallel before the assets are processed
+
+    inline_algorithms: typing.Dict[str, typing.Set[str]] = {i: set() for i in target_asset_ids}
+    for i in verified_on_copy:
+      inline_algorithms[i].add(pkl_asset_resolver[i].hash_algorithm)
+
+    new_digests: typing.Dict[str, str] = {}
+
+    if hash_algorithm is not None and action != Action.DRYRUN:
+      rehashed_sources: typing.Dict[str, SourceCandidate] = {}
+
+      for i in target_asset_ids:
+        source = sources[i]
+        if pkl_asset_resolver[i].hash_algorithm == hash_algorithm:
+          continue
+
+        digest = source.storage.cached_digest(source.am_asset.path, hash_algorithm, digest_cache)
+
+        if digest is not None:
+          new_digests[i] = digest
+        elif action == Action.COPY and i not in existing_assets:
+          inline_algorithms[i].add(hash_algorithm)
+        else:
+          rehashed_sources[i] = source
+
+      if len(rehashed_sources) > 0:
+        start_time = time.perf_counter()
+        new_digests.update(_compute_digests(rehashed_sources, hash_algorithm, digest_cache))
+        LOGGER.info("%d asset(s) hashed in %.3f s", len(rehashed_sources), time.perf_counter() - start_time)
+
+    # assign assets to volumes, the PackingList being on the first volume
+
+    volume_count = len(volumes)
+
+    if volume_count > 1:
+      volume_assignment = assign_volumes({i: pkl_asset_resolver[i].size for i in target_asset_ids}, volume_count)
+
+      for v in range(1, volume_count + 1):
+        LOGGER.info(
+          "Volume %s (%s): %s bytes",
+          v,
+          volumes[v - 1],
+          sum(pkl_asset_resolver[i].size for i in target_asset_ids if volume_assignment[i] == v)
+        )
+    else:
+      volume_assignment = {i: None for i in target_asset_ids}
 
-  if action != Action.DRYRUN:
-    target_am.write(dest_dir_path.joinpath("ASSETMAP.xml"))
+    # process assets, writing to all volumes in parallel
 
-  LOGGER.info("Target AssetMap written")
+    def _transfer_volume(v: int) -> int:
+      volume_mismatches = 0
+      for i in target_asset_ids.difference(existing_assets):
+        if volume_count == 1 or volume_assignment[i] == v:
+          pkl_asset = pkl_asset_resolver[i]
+          digests = _transfer_asset(volumes[v - 1], sources[i], pkl_asset, action, digest_cache, inline_algorithms[i],
+                                    allow_size_mismatch)
 
-  # process assets
+          if i in verified_on_copy:
+            if digests[pkl_asset.hash_algorithm] != pkl_asset.hash:
+              LOGGER.error("Hash of %s in %s does not match its PackingList", sources[i].am_asset.path, sources[i].storage)
+              volume_mismatches += 1
+            else:
+              LOGGER.info("Verified %s", sources[i].am_asset.path)
 
-  for i in target_asset_ids:
+          if hash_algorithm in digests:
+            new_digests[i] = digests[hash_algorithm]
+      return volume_mismatches
 
-    src_path = path_resolver[i]
-    am_asset = am_asset_resolver[i]
-    dst_path = dest_dir_path.joinpath(am_asset.path)
+    start_time = time.perf_counter()
 
-    if action == Action.COPY:
-      LOGGER.info("Copying %s to %s", am_asset.path, dst_path)
-      shutil.copy(src_path, dst_path)
-    elif action == Action.MOVE:
-      LOGGER.info("Moving %s to %s", am_asset.path, dst_path)
-      shutil.move(src_path, dst_path)
-    elif action == Action.SYMLINK:
-      LOGGER.info("Symlink from %s to %s", am_asset.path, dst_path)
-      dst_path.symlink_to(src_path)
+    if volume_count == 1:
+      mismatches = _transfer_volume(1)
     else:
-      LOGGER.info("Skipping copying %s to %s", am_asset.path, dst_path)
+      with concurrent.futures.ThreadPoolExecutor(max_workers=volume_count) as executor:
+        mismatches = sum(f.result() for f in [executor.submit(_transfer_volume, v) for v in range(1, volume_count + 1)])
+
+    LOGGER.info("Assets transferred in %.3f s (durability: %s)", time.perf_counter() - start_time, durability.value)
+
+    # the manifests are written once all assets are present and durable, and only if they match their
+    # PackingList, so that a crash never leaves an AssetMap that lists incomplete assets
+
+    if mismatches == 0:
+
+      if action != Action.DRYRUN:
+        start_time = time.perf_counter()
+
+        for volume in volumes:
+          volume.sync()
+
+        LOGGER.info("Volumes synced in %.3f s (durability: %s)", time.perf_counter() - start_time, durability.value)
+
+      # create PKL for the Target
+
+      target_pkl = repkl.pkl.PackingList(
+        assets=[
+          dataclasses.replace(pkl_asset_resolver[i], hash=new_digests[i], hash_algorithm=hash_algorithm)
+          if i in new_digests else pkl_asset_resolver[i]
+          for i in target_asset_ids
+        ],
+        creator=CREATOR_STRING,
+        issuer=target_cpl.issuer,
+        issuer_lang=target_cpl.issuer_lang,
+        annotation=target_cpl.content_title,
+        annotation_lang=target_cpl.content_title_lang
+      )
+
+      pkl_fn = f"PKL_{str(uuid.UUID(target_pkl.id))}.xml"
+
+      if action != Action.DRYRUN:
+        dest.write_bytes(pkl_fn, _serialize(target_pkl))
+
+      LOGGER.info("Target PackingList written (%s)", pkl_fn)
+
+      # build Asset Map for the Target, which, in append mode, also lists the assets already present
+
+      new_am_assets = [
+        dataclasses.replace(sources[i].am_asset, volume_index=volume_assignment[i])
+        for i in target_asset_ids.difference(existing_assets)
+      ]
+
+      if existing_am is not None:
+        target_am = dataclasses.replace(
+          existing_am,
+          assets=existing_am.assets + new_am_assets,
+          issue_date=repkl.utils.make_iso_ts()
+        )
+      else:
+        target_am = repkl.assetmap.AssetMap(
+          assets=new_am_assets,
+          creator=CREATOR_STRING,
+          issuer=target_cpl.issuer,
+          issuer_lang=target_cpl.issuer_lang,
+          annotation=target_cpl.content_title,
+          annotation_lang=target_cpl.content_title_lang,
+          volume_count=volume_count
+        )
+
+      target_am.assets.append(repkl.assetmap.Asset(
+        id=target_pkl.id,
+        path=pkl_fn,
+        is_pkl=True,
+        volume_index=1 if volume_count > 1 else None
+      ))
+
+      # every volume holds the Asset Map and its Volume Index
+
+      if action != Action.DRYRUN:
+        am_data = _serialize(target_am)
+
+        for v, volume in enumerate(volumes, 1):
+          if volume_count > 1:
+            volume.write_bytes(repkl.assetmap.VOLINDEX_FILENAME, _serialize(repkl.assetmap.VolumeIndex(v)))
+          volume.write_bytes(ASSETMAP_FILENAME, am_data)
+
+      LOGGER.info("Target AssetMap written")
+
+    if mismatches > 0:
+      raise ValueError(f"{mismatches} asset(s) do not match their PackingList hash")
+
+    succeeded = True
+
+  finally:
+    # closing the volumes syncs any remaining files under the batch durability policy, while volumes of a
+    # failed run are aborted so that, e.g., tar streams are not terminated as if they were complete
+
+    start_time = time.perf_counter()
+
+    _close_storages(volumes if len(volumes) > 0 else dests, abort=not succeeded)
+
+    LOGGER.info("Volumes closed in %.3f s (durability: %s)", time.perf_counter() - start_time, durability.value)
+
+    _close_storages(am_dirs.union(cpl_storages, index_roots.values()).difference(dests, volumes))
 
 if __name__ == "__main__":
 
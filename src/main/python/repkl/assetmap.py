@@ -32,22 +32,28 @@ from repkl.utils import get_ns, make_text_element, make_uuid, make_iso_ts, prett
 
 AM2007_NS = "http://www.smpte-ra.org/schemas/429-9/2007/AM"
 
+ASSETMAP_FILENAME = "ASSETMAP.xml"
+VOLINDEX_FILENAME = "VOLINDEX.xml"
+
 @dataclass(frozen=True)
 class Asset:
   id: str
   path: str
   is_pkl: bool
+  volume_index: Optional[int] = None
 
   @staticmethod
   def from_element(asset_elem: ET.Element) -> Asset:
     ns = { "am": get_ns(asset_elem)}
 
     is_pkl_element = asset_elem.find("am:PackingList", ns)
+    volume_index_element = asset_elem.find(".//am:VolumeIndex", ns)
 
     return Asset(
       asset_elem.find("am:Id", ns).text.lower(),
       asset_elem.find(".//am:Path", ns).text,
-      is_pkl_element is not None and is_pkl_element.text.lower() in ("true", "1")
+      is_pkl_element is not None and is_pkl_element.text.lower() in ("true", "1"),
+      int(volume_index_element.text) if volume_index_element is not None else None
       )
 
   def to_element(self) -> ET.Element:
@@ -62,6 +68,8 @@ class Asset:
 
     chunk_elem = ET.Element(f"{{{AM2007_NS}}}Chunk")
     chunk_elem.append(path_elem)
+    if self.volume_index is not None:
+      chunk_elem.append(make_text_element(f"{{{AM2007_NS}}}VolumeIndex", str(self.volume_index)))
 
     chunklist_elem = ET.Element(f"{{{AM2007_NS}}}ChunkList")
     chunklist_elem.append(chunk_elem)
@@ -81,6 +89,7 @@ class AssetMap:
   issuer_lang: Optional[str] = None
   annotation: Optional[str] = None
   annotation_lang: Optional[str] = None
+  volume_count: int = 1
 
   @staticmethod
   def from_element(am_elem: ET.Element) -> AssetMap:
@@ -95,6 +104,10 @@ class AssetMap:
       issue_date=am_elem.find("am:IssueDate", ns).text
     )
 
+    volume_count_elem = am_elem.find("am:VolumeCount", ns)
+    if volume_count_elem is not None:
+      am.volume_count = int(volume_count_elem.text)
+
     annotation_elem = am_elem.find("am:AnnotationText", ns)
     if annotation_elem is not None:
       am.annotation = annotation_elem.text
@@ -112,7 +125,7 @@ class AssetMap:
     if self.annotation is not None:
       am_element.append(make_text_element(f"{{{AM2007_NS}}}AnnotationText", self.annotation, self.annotation_lang))
     am_element.append(make_text_element(f"{{{AM2007_NS}}}Creator", self.creator, self.creator_lang))
-    am_element.append(make_text_element(f"{{{AM2007_NS}}}VolumeCount", "1"))
+    am_element.append(make_text_element(f"{{{AM2007_NS}}}VolumeCount", str(self.volume_count)))
     am_element.append(make_text_element(f"{{{AM2007_NS}}}IssueDate",self.issue_date))
     am_element.append(make_text_element(f"{{{AM2007_NS}}}Issuer", self.issuer, self.issuer_lang))
 
@@ -128,4 +141,26 @@ class AssetMap:
   def write(self, fp: IO):
     doc = self.to_element()
     pretty_print(doc)
-    doc.write(fp, encoding="utf-8")
\ No newline at end of file
+    doc.write(fp, encoding="utf-8")
+
+@dataclass(frozen=True)
+class VolumeIndex:
+  index: int
+
+  @staticmethod
+  def from_element(vi_elem: ET.Element) -> VolumeIndex:
+    ns = { "am": get_ns(vi_elem)}
+
+    return VolumeIndex(int(vi_elem.find("am:Index", ns).text))
+
+  def to_element(self) -> ET.ElementTree:
+    vi_element = ET.Element(f"{{{AM2007_NS}}}VolumeIndex")
+
+    vi_element.append(make_text_element(f"{{{AM2007_NS}}}Index", str(self.index)))
+
+    return ET.ElementTree(vi_element)
+
+  def write(self, fp: IO):
+    doc = self.to_element()
+    pretty_print(doc)
+    doc.write(fp, encoding="utf-8")
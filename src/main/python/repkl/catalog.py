@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Catalog of the CPLs of a collection of Mapped File Sets and of the assets they reference,
+stored as an inverted index (asset -> referencing CPLs) in an SQLite database."""
+
+from __future__ import annotations
+import json
+import sqlite3
+import typing
+import pathlib
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+import repkl.cpl
+import repkl.pkl
+import repkl.index
+import repkl.storage
+
+LOGGER = logging.getLogger("repkl")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+  location TEXT PRIMARY KEY,
+  fingerprint TEXT,
+  complete INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+  id TEXT NOT NULL,
+  root TEXT NOT NULL REFERENCES roots(location) ON DELETE CASCADE,
+  path TEXT NOT NULL,
+  size INTEGER,
+  kind TEXT NOT NULL,
+  PRIMARY KEY (id, root)
+);
+CREATE TABLE IF NOT EXISTS refs (
+  asset_id TEXT NOT NULL,
+  cpl_id TEXT NOT NULL,
+  root TEXT NOT NULL REFERENCES roots(location) ON DELETE CASCADE,
+  PRIMARY KEY (asset_id, cpl_id, root)
+);
+CREATE INDEX IF NOT EXISTS refs_cpl ON refs (cpl_id);
+CREATE INDEX IF NOT EXISTS assets_kind ON assets (kind);
+"""
+
+# kinds of assets
+KIND_PKL = "pkl"
+KIND_CPL = "cpl"
+KIND_ASSET = "asset"
+
+@dataclass(frozen=True)
+class CatalogAsset:
+  id: str
+  root: str
+  path: str
+  size: typing.Optional[int]
+
+class Catalog:
+
+  def __init__(self, path: pathlib.Path):
+    self.path = path
+    self._db = sqlite3.connect(str(path))
+    self._db.execute("PRAGMA foreign_keys = ON")
+    self._db.executescript(SCHEMA)
+
+  def __enter__(self) -> Catalog:
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self._db.close()
+
+  @property
+  def roots(self) -> typing.List[str]:
+    return [r for (r,) in self._db.execute("SELECT location FROM roots ORDER BY location")]
+
+  @property
+  def incomplete_roots(self) -> typing.List[str]:
+    """Mapped File Sets some of whose CPLs could not be read when they were last scanned."""
+    return [r for (r,) in self._db.execute("SELECT location FROM roots WHERE NOT complete ORDER BY location")]
+
+  def _add_mapped_file_set(self, storage: repkl.storage.Storage, fingerprint: typing.Optional[typing.List[int]],
+                           pkl_assets: typing.Dict[str, repkl.pkl.Asset]):
+    location = storage.location
+
+    self._db.execute("DELETE FROM roots WHERE location = ?", (location,))
+    self._db.execute("INSERT INTO roots VALUES (?, ?, 1)", (location, json.dumps(fingerprint)))
+
+    assets = []
+    refs = []
+    complete = True
+
+    for am_asset, pkl_asset in repkl.index.scan_mapped_file_set(storage, pkl_assets):
+      pkl_asset = pkl_asset if pkl_asset is not None else pkl_assets.get(am_asset.id)
+      kind = KIND_PKL if am_asset.is_pkl else KIND_ASSET
+
+      if pkl_asset is not None and pkl_asset.type == "text/xml":
+        try:
+          cpl = repkl.cpl.load_composition(storage, am_asset.path)
+        except repkl.cpl.NotACompositionError:
+          cpl = None
+        except (OSError, ValueError, ET.ParseError) as e:
+          LOGGER.warning("Cannot read %s in %s: %s", am_asset.path, location, e)
+          complete = False
+          cpl = None
+
+        if cpl is not None:
+          kind = KIND_CPL
+          refs.extend((asset_id, cpl.id, location) for asset_id in cpl.resource_ids)
+
+      assets.append((am_asset.id, location, am_asset.path, pkl_asset.size if pkl_asset is not None else None, kind))
+
+    self._db.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?)", assets)
+    self._db.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?, ?)", refs)
+
+    # the references of an unreadable CPL are unknown: the root is scanned again on the next refresh
+    if not complete:
+      self._db.execute("UPDATE roots SET fingerprint = ?, complete = 0 WHERE location = ?", (json.dumps(None), location))
+
+  def update(self, mapped_file_sets: typing.Iterable[repkl.storage.Storage], refresh: bool = False,
+             storage_options: typing.Optional[typing.Mapping[str, typing.Any]] = None):
+    """Adds `mapped_file_sets` to the catalog. If `refresh` is true, the Mapped File Sets already in
+    the catalog whose AssetMap has changed are also scanned again, and those that no longer exist
+    are removed."""
+
+    storage_options = storage_options if storage_options is not None else {}
+
+    storages = {s.location: s for s in mapped_file_sets}
+    fingerprints = {}
+    pkl_assets: typing.Dict[str, repkl.pkl.Asset] = {}
+
+    if refresh:
+      for location, fingerprint in self._db.execute("SELECT location, fingerprint FROM roots").fetchall():
+        if location not in storages:
+          storages[location] = repkl.storage.open_storage(location, **storage_options)
+          fingerprints[location] = json.loads(fingerprint)
+
+    with self._db:
+      for location, storage in storages.items():
+        try:
+          fingerprint = repkl.index.fingerprint_mapped_file_set(storage)
+        except OSError:
+          LOGGER.warning("Removing %s from the catalog: no AssetMap found", location)
+          self._db.execute("DELETE FROM roots WHERE location = ?", (location,))
+          continue
+
+        if fingerprint is not None and fingerprints.get(location) == fingerprint:
+          continue
+
+        LOGGER.info("Cataloging %s", location)
+        self._add_mapped_file_set(storage, fingerprint, pkl_assets)
+
+  def cpls(self) -> typing.List[str]:
+    return [i for (i,) in self._db.execute("SELECT DISTINCT id FROM assets WHERE kind = ? ORDER BY id", (KIND_CPL,))]
+
+  def referenced_assets(self, cpl_ids: typing.Iterable[str]) -> typing.Set[str]:
+    """Returns the ids of the assets referenced by any of the CPLs `cpl_ids`."""
+    ids = list(cpl_ids)
+    return {
+      i for (i,) in self._db.execute(
+        f"SELECT DISTINCT asset_id FROM refs WHERE cpl_id IN ({','.join('?' * len(ids))})", ids
+      )
+    }
+
+  def referencing_cpls(self, asset_id: str) -> typing.Set[str]:
+    """Returns the ids of the CPLs that reference the asset `asset_id`."""
+    return {i for (i,) in self._db.execute("SELECT DISTINCT cpl_id FROM refs WHERE asset_id = ?", (asset_id,))}
+
+  def required_size(self, cpl_ids: typing.Iterable[str]) -> int:
+    """Returns the number of bytes occupied by the CPLs `cpl_ids` and the assets they reference,
+    counting each asset once."""
+    ids = list(cpl_ids)
+    placeholders = ",".join("?" * len(ids))
+    (size,) = self._db.execute(
+      f"""SELECT COALESCE(SUM(size), 0) FROM (
+            SELECT MAX(size) AS size FROM assets
+            WHERE id IN (SELECT asset_id FROM refs WHERE cpl_id IN ({placeholders})) OR id IN ({placeholders})
+            GROUP BY id)""",
+      ids + ids
+    ).fetchone()
+    return size
+
+  def unreferenced_assets(self) -> typing.List[CatalogAsset]:
+    """Returns every copy of the assets, other than PackingLists and CPLs, that are not referenced
+    by any CPL in the catalog. Raises `ValueError` if any CPL could not be read, since the assets
+    it references would otherwise be reported as unreferenced."""
+
+    incomplete = self.incomplete_roots
+    if len(incomplete) > 0:
+      raise ValueError(f"Some CPLs could not be read in {', '.join(incomplete)}: refresh the catalog first")
+
+    return [
+      CatalogAsset(*row) for row in self._db.execute(
+        """SELECT id, root, path, size FROM assets
+           WHERE kind = ? AND id NOT IN (SELECT asset_id FROM refs)
+           ORDER BY root, path""",
+        (KIND_ASSET,)
+      )
+    ]
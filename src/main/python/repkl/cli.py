@@ -24,59 +24,287 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import sys
 import pathlib
+import typing
 
 import repkl.algorithm
+import repkl.storage
+import repkl.digest
+import repkl.index
+import repkl.catalog
 
 def main(argv=None):
   parser = argparse.ArgumentParser(description="Repackages an IMF CPL into a new Mapped File Set.")
-  parser.add_argument('target', help="Path of the target CPL that will be repackaged.")
-  parser.add_argument('dest', help="Path of the directory where the new Mapped File Set is created")
+  parser.add_argument('target', help="Path, s3:// or http(s):// URL of the target CPL that will be repackaged.")
+  parser.add_argument('dest', nargs='+', help="""Path or s3:// URL of the directory where the new Mapped File Set is created,
+                                      or, with `--output-format tar`, path of the tar file or `-` for stdout. When several
+                                      destinations are provided, each receives the same Mapped File Set and each asset is read once.""")
   parser.add_argument('--delivery', action='append', type=str,
-    help="""Path to an Mapped File Set where the assets of the target CPL are found.
+    help="""Path, s3:// or http(s):// URL to an Mapped File Set where the assets of the target CPL are found.
             If omitted, the target and OV CPLs are assumed to be at the root of a mapped file set.""")
-  parser.add_argument('--ov', help="Path to an OV CPL. If omitted, the target CPL is an OV CPL.")
+  parser.add_argument('--ov', help="Path, s3:// or http(s):// URL to an OV CPL. If omitted, the target CPL is an OV CPL.")
   parser.add_argument('--action', choices=[e.value for e in repkl.algorithm.Action],
     default=repkl.algorithm.Action.COPY.value,
     help="Indicates whether assets will be copied or moved to the new Mapped File Set.")
+  parser.add_argument('--fast-device', action='append', type=str,
+    help="""Path on a device known to be fast, in decreasing order of speed. When an asset is present in
+            several Mapped File Sets, copies on these devices are preferred, after copies on the destination device.""")
+  parser.add_argument('--index', type=str,
+    help="Path of an asset index, built using `repkl-index`, used to locate assets instead of parsing AssetMaps.")
+  parser.add_argument('--verify', action='store_true',
+    help="Verifies the hash of every asset against its PackingList before writing the new Mapped File Set.")
+  parser.add_argument('--allow-size-mismatch', action='store_true',
+    help="""Copies assets whose size differs from their PackingList, e.g. CPLs whose line endings were converted,
+            with a warning instead of failing. Ignored with --verify.""")
+  parser.add_argument('--digest-cache', type=str,
+    help=f"""Path of the database that caches digests of files that do not support extended attributes.
+             Defaults to {repkl.digest.default_sidecar_path()}.""")
+  parser.add_argument('--append', action='store_true',
+    help="""Adds the target CPL to the existing Mapped File Set at `dest`: only the assets that are not already
+            present are transferred, a PackingList is added and the AssetMap is updated.""")
+  parser.add_argument('--hash-algorithm', choices=list(repkl.digest.HASH_ALGORITHMS.values()),
+    help="""Hash algorithm of the new PackingList, e.g. sha256. The digests of assets whose PackingList uses another
+            algorithm are recomputed, while the assets are copied or otherwise in parallel, unless cached.""")
+  parser.add_argument('--volume', action='append', type=str,
+    help="""Path or s3:// URL of an additional, empty, directory where the new Mapped File Set is created.
+            Assets are balanced across `dest` and these volumes, which are written in parallel.""")
+  parser.add_argument('--output-format', choices=["directory", "tar"], default="directory",
+    help="Indicates whether the new Mapped File Set is written to a directory or as a streaming tar archive.")
+  parser.add_argument('--durability', choices=[e.value for e in repkl.storage.Durability],
+    default=repkl.storage.Durability.NONE.value,
+    help="""Indicates whether files written to local destinations are synced to stable storage: `none`, `batch` (once,
+            after all files are written) or `per-file` (as each file is written).""")
+  parser.add_argument('--s3-endpoint', type=str,
+    help="URL of the S3-compatible service used for s3:// locations, e.g. http://localhost:9000.")
+  parser.add_argument('--s3-region', type=str, help="Region used to sign S3 requests.")
+  parser.add_argument('--part-size', type=int, default=repkl.storage.DEFAULT_PART_SIZE,
+    help="""Size in bytes of the parts of multipart uploads to S3, at least 5 MiB, and of the range requests to
+            HTTP sources.""")
+  parser.add_argument('--concurrency', type=int, default=repkl.storage.DEFAULT_CONCURRENCY,
+    help="Maximum number of parts of a multipart upload, or of range requests to an HTTP source, in flight at once.")
 
   args = parser.parse_args(argv)
 
   action = repkl.algorithm.Action(args.action)
 
-  target_cpl_path = pathlib.Path(args.target)
-  if not target_cpl_path.is_file():
-    raise ValueError("Target path is not to a file.")
+  durability = repkl.storage.Durability(args.durability)
+
+  if args.hash_algorithm is not None:
+    hash_algorithm = next(k for k, v in repkl.digest.HASH_ALGORITHMS.items() if v == args.hash_algorithm)
+  else:
+    hash_algorithm = None
 
-  dest_path = pathlib.Path(args.dest)
-  if action is not repkl.algorithm.Action.DRYRUN:
-    if not dest_path.is_dir():
-      raise ValueError("Destination path is not to a directory.")
-    if len(list(dest_path.iterdir())) > 0:
-      raise ValueError("Destination directory is not empty.")
+  storage_options = {
+    "endpoint": args.s3_endpoint,
+    "region": args.s3_region,
+    "part_size": args.part_size,
+    "concurrency": args.concurrency
+  }
+
+  target_storage, target_fn = repkl.storage.open_file_location(args.target, **storage_options)
+  if isinstance(target_storage, repkl.storage.LocalStorage) and not target_storage.path(target_fn).is_file():
+    raise ValueError("Target path is not to a file.")
 
   if args.delivery is not None:
-    delivery_paths = [pathlib.Path(e) for e in args.delivery]
-    if not all(e.is_dir() for e in delivery_paths):
+    deliveries = [repkl.storage.open_storage(e, **storage_options) for e in args.delivery]
+    if not all(e.root.is_dir() for e in deliveries if isinstance(e, repkl.storage.LocalStorage)):
       raise ValueError("Not all deliveries point to a directory.")
   else:
-    delivery_paths = None
+    deliveries = None
 
   if args.ov is not None:
-    ov_path =  pathlib.Path(args.ov)
-    if not ov_path.is_file():
+    ov_storage, ov_fn = repkl.storage.open_file_location(args.ov, **storage_options)
+    if isinstance(ov_storage, repkl.storage.LocalStorage) and not ov_storage.path(ov_fn).is_file():
       raise ValueError("OV path is not to a file.")
+    ov_path = args.ov
   else:
     ov_path = None
 
-  repkl.algorithm.process(
-    target_cpl_path=target_cpl_path,
-    dest_dir_path=dest_path,
-    mapped_file_set_paths=delivery_paths,
-    base_cpl_path=ov_path,
-    action=repkl.algorithm.Action(args.action)
+  if args.fast_device is not None:
+    fast_device_paths = [pathlib.Path(e) for e in args.fast_device]
+    if not all(e.exists() for e in fast_device_paths):
+      raise ValueError("Not all fast device paths exist.")
+  else:
+    fast_device_paths = None
+
+  # the destinations are closed by `process`, or aborted here if the command fails before they are handed over
+
+  dests: typing.List[repkl.storage.Storage] = []
+  volumes: typing.List[repkl.storage.Storage] = []
+  index = None
+  digest_cache = None
+
+  try:
+    if args.volume is not None:
+      if args.output_format == "tar":
+        raise ValueError("Multiple volumes cannot be written as a tar archive.")
+      if len(args.dest) > 1:
+        raise ValueError("Multiple volumes cannot be written to multiple destinations.")
+      volumes.extend(repkl.storage.open_storage(e, durability, **storage_options) for e in args.volume)
+
+    if args.append and (args.output_format == "tar" or len(args.dest) > 1 or args.volume is not None):
+      raise ValueError("Assets can only be appended to a single destination directory.")
+
+    if args.output_format == "tar":
+      if action in (repkl.algorithm.Action.MOVE, repkl.algorithm.Action.SYMLINK):
+        raise ValueError("Assets cannot be moved or symlinked into a tar archive.")
+      if args.dest.count("-") > 1:
+        raise ValueError("Only one tar archive can be written to stdout.")
+      if action is not repkl.algorithm.Action.DRYRUN:
+        if any(pathlib.Path(e).exists() for e in args.dest if e != "-"):
+          raise ValueError("Destination tar file already exists.")
+        for e in args.dest:
+          if e == "-":
+            dests.append(repkl.storage.TarStorage(sys.stdout.buffer))
+          else:
+            dests.append(repkl.storage.TarStorage(pathlib.Path(e).open("xb"), close_fileobj=True))
+    else:
+      dests.extend(repkl.storage.open_storage(e, durability, **storage_options) for e in args.dest)
+
+    if action is not repkl.algorithm.Action.DRYRUN and args.output_format == "directory":
+      for e in dests + volumes:
+        if e.read_only:
+          raise ValueError(f"Destination {e} is read-only.")
+        if isinstance(e, repkl.storage.LocalStorage) and not e.root.is_dir():
+          raise ValueError("Destination path is not to a directory.")
+        if not args.append and not e.is_empty():
+          raise ValueError("Destination directory is not empty.")
+
+    if args.index is not None:
+      index = repkl.index.AssetIndex(pathlib.Path(args.index))
+
+    digest_cache = repkl.digest.DigestCache(
+      pathlib.Path(args.digest_cache) if args.digest_cache is not None else None
+    )
+  except BaseException:
+    for e in dests + volumes:
+      e.abort()
+    if index is not None:
+      index.close()
+    raise
+
+  try:
+    repkl.algorithm.process(
+      target_cpl_path=args.target,
+      dest_dir_path=dests if len(dests) > 0 else args.dest,
+      mapped_file_set_paths=deliveries,
+      base_cpl_path=ov_path,
+      action=repkl.algorithm.Action(args.action),
+      storage_options=storage_options,
+      fast_device_paths=fast_device_paths,
+      verify=args.verify,
+      digest_cache=digest_cache,
+      index=index,
+      extra_volume_paths=volumes,
+      durability=durability,
+      hash_algorithm=hash_algorithm,
+      append=args.append,
+      allow_size_mismatch=args.allow_size_mismatch
+    )
+  finally:
+    digest_cache.close()
+
+    if index is not None:
+      index.close()
+
+def index_main(argv=None):
+  parser = argparse.ArgumentParser(description="Builds an index of the assets of a collection of Mapped File Sets.")
+  parser.add_argument('command', choices=["build", "refresh"],
+    help="""`build` indexes only the specified Mapped File Sets. `refresh` also re-indexes the Mapped File Sets
+            of the existing index whose AssetMap has changed, and drops those that no longer exist.""")
+  parser.add_argument('index', help="Path of the index file.")
+  parser.add_argument('delivery', nargs='*', help="Path or s3:// URL of a Mapped File Set to index.")
+  parser.add_argument('--s3-endpoint', type=str,
+    help="URL of the S3-compatible service used for s3:// locations, e.g. http://localhost:9000.")
+  parser.add_argument('--s3-region', type=str, help="Region used to sign S3 requests.")
+
+  args = parser.parse_args(argv)
+
+  if args.command == "build" and len(args.delivery) == 0:
+    raise ValueError("At least one Mapped File Set must be specified.")
+
+  storage_options = {
+    "endpoint": args.s3_endpoint,
+    "region": args.s3_region
+  }
+
+  deliveries = [repkl.storage.open_storage(e, **storage_options) for e in args.delivery]
+  if not all(e.root.is_dir() for e in deliveries if isinstance(e, repkl.storage.LocalStorage)):
+    raise ValueError("Not all deliveries point to a directory.")
+
+  repkl.index.build_index(
+    pathlib.Path(args.index),
+    deliveries,
+    refresh=args.command == "refresh",
+    storage_options=storage_options
   )
 
+def catalog_main(argv=None):
+  parser = argparse.ArgumentParser(description="Queries the CPLs of a collection of Mapped File Sets and the assets they reference.")
+  parser.add_argument('catalog', help="Path of the catalog file.")
+  parser.add_argument('--s3-endpoint', type=str,
+    help="URL of the S3-compatible service used for s3:// locations, e.g. http://localhost:9000.")
+  parser.add_argument('--s3-region', type=str, help="Region used to sign S3 requests.")
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  add_parser = subparsers.add_parser('add', help="Adds Mapped File Sets to the catalog.")
+  add_parser.add_argument('delivery', nargs='+', help="Path or s3:// URL of a Mapped File Set.")
+
+  refresh_parser = subparsers.add_parser('refresh',
+    help="Scans again the Mapped File Sets whose AssetMap has changed and removes those that no longer exist.")
+  refresh_parser.add_argument('delivery', nargs='*', help="Path or s3:// URL of an additional Mapped File Set.")
+
+  subparsers.add_parser('cpls', help="Lists the CPLs in the catalog.")
+
+  assets_parser = subparsers.add_parser('assets', help="Lists the assets referenced by CPLs.")
+  assets_parser.add_argument('cpl', nargs='+', help="Id of a CPL.")
+
+  references_parser = subparsers.add_parser('references', help="Lists the CPLs that reference an asset.")
+  references_parser.add_argument('asset', help="Id of an asset.")
+
+  size_parser = subparsers.add_parser('size', help="Number of bytes needed by CPLs and the assets they reference.")
+  size_parser.add_argument('cpl', nargs='+', help="Id of a CPL.")
+
+  subparsers.add_parser('unreferenced',
+    help="Prints a removal plan for the assets that are not referenced by any CPL in the catalog.")
+
+  args = parser.parse_args(argv)
+
+  storage_options = {
+    "endpoint": args.s3_endpoint,
+    "region": args.s3_region
+  }
+
+  with repkl.catalog.Catalog(pathlib.Path(args.catalog)) as catalog:
+
+    if args.command in ("add", "refresh"):
+      deliveries = [repkl.storage.open_storage(e, **storage_options) for e in args.delivery]
+      if not all(e.root.is_dir() for e in deliveries if isinstance(e, repkl.storage.LocalStorage)):
+        raise ValueError("Not all deliveries point to a directory.")
+      catalog.update(deliveries, refresh=args.command == "refresh", storage_options=storage_options)
+
+    elif args.command == "cpls":
+      for cpl_id in catalog.cpls():
+        print(cpl_id)
+
+    elif args.command == "assets":
+      for asset_id in sorted(catalog.referenced_assets(e.lower() for e in args.cpl)):
+        print(asset_id)
+
+    elif args.command == "references":
+      for cpl_id in sorted(catalog.referencing_cpls(args.asset.lower())):
+        print(cpl_id)
+
+    elif args.command == "size":
+      print(catalog.required_size(e.lower() for e in args.cpl))
+
+    elif args.command == "unreferenced":
+      assets = catalog.unreferenced_assets()
+      for a in assets:
+        print(f"{a.size if a.size is not None else '?'}\t{a.root}/{a.path}")
+      print(f"# {len(assets)} file(s), {sum(a.size for a in assets if a.size is not None)} bytes. "
+            "AssetMaps and PackingLists that list these files are not updated.")
+
 if __name__ == "__main__":
-  import sys
   main(sys.argv[1:])
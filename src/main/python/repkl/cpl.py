@@ -25,11 +25,23 @@
 
 from __future__ import annotations
 import xml.etree.ElementTree as ET
-from typing import AbstractSet, Optional
+import os
+import threading
+import collections
+from typing import AbstractSet, BinaryIO, Dict, Optional, Tuple
 from dataclasses import dataclass
 
+import repkl.storage
 from repkl.utils import get_ns
 
+# number of parsed CPLs retained by `load_composition`
+COMPOSITION_CACHE_SIZE = 64
+
+_HEADER_FIELDS = ("Id", "AnnotationText", "ContentTitle", "Creator", "Issuer")
+
+class NotACompositionError(ValueError):
+  pass
+
 @dataclass(frozen=True)
 class Composition:
   resource_ids: AbstractSet[str]
@@ -64,3 +76,92 @@ class Composition:
       content_title=ct_element.text if ct_element is not None else None,
       content_title_lang=ct_element.attrib.get("language") if ct_element is not None else None
     )
+
+  @staticmethod
+  def from_stream(fp: BinaryIO) -> Composition:
+    """Reads a CPL incrementally, retaining only its header fields and the TrackFileId of its resources,
+    so that the memory used does not grow with the number of segments and sequences of the CPL."""
+
+    ns = None
+    parents = []
+    header: Dict[str, ET.Element] = {}
+    resource_ids = set()
+
+    for event, elem in ET.iterparse(fp, events=("start", "end")):
+      if event == "start":
+        if ns is None:
+          if not elem.tag.startswith("{"):
+            raise NotACompositionError(f"{elem.tag} is not a CompositionPlaylist")
+          ns = get_ns(elem)
+          if elem.tag != f"{{{ns}}}CompositionPlaylist":
+            raise NotACompositionError(f"{elem.tag} is not a CompositionPlaylist")
+        parents.append(elem)
+        continue
+
+      parents.pop()
+
+      if len(parents) == 0:
+        break
+
+      if elem.tag == f"{{{ns}}}TrackFileId" and parents[-1].tag == f"{{{ns}}}Resource":
+        resource_ids.add(elem.text.lower())
+
+      name = elem.tag[len(ns) + 2:] if elem.tag.startswith(f"{{{ns}}}") else None
+
+      if len(parents) == 1 and name in _HEADER_FIELDS and name not in header:
+        header[name] = elem
+      else:
+        # elements are discarded once read
+        parents[-1].remove(elem)
+
+    if "Id" not in header:
+      raise ValueError("CPL is missing its Id")
+
+    def _text(name: str) -> Optional[str]:
+      return header[name].text if name in header else None
+
+    def _lang(name: str) -> Optional[str]:
+      return header[name].attrib.get("language") if name in header else None
+
+    return Composition(
+      resource_ids=frozenset(resource_ids),
+      id=header["Id"].text.lower(),
+      creator=_text("Creator"),
+      creator_lang=_lang("Creator"),
+      issuer=_text("Issuer"),
+      issuer_lang=_lang("Issuer"),
+      annotation=_text("AnnotationText"),
+      annotation_lang=_lang("AnnotationText"),
+      content_title=_text("ContentTitle"),
+      content_title_lang=_lang("ContentTitle")
+    )
+
+_composition_cache: collections.OrderedDict[Tuple[int, int, int, int], Composition] = collections.OrderedDict()
+_composition_cache_lock = threading.Lock()
+
+def load_composition(storage: repkl.storage.Storage, path: str) -> Composition:
+  """Reads the CPL at `path` using `Composition.from_stream`. Local CPLs are memoized by file identity
+  (device, inode, size and modification time), so that a CPL used by many jobs is parsed once."""
+
+  if not isinstance(storage, repkl.storage.LocalStorage):
+    with storage.open(path) as fp:
+      return Composition.from_stream(fp)
+
+  with storage.open(path) as fp:
+    st = os.fstat(fp.fileno())
+    identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    with _composition_cache_lock:
+      composition = _composition_cache.get(identity)
+      if composition is not None:
+        _composition_cache.move_to_end(identity)
+        return composition
+
+    composition = Composition.from_stream(fp)
+
+  with _composition_cache_lock:
+    _composition_cache[identity] = composition
+    while len(_composition_cache) > COMPOSITION_CACHE_SIZE:
+      _composition_cache.popitem(last=False)
+
+  return composition
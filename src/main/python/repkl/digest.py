@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import annotations
+import os
+import json
+import base64
+import hashlib
+import pathlib
+import sqlite3
+import threading
+import typing
+from dataclasses import dataclass
+
+SHA1_URI = "http://www.w3.org/2000/09/xmldsig#sha1"
+SHA256_URI = "http://www.w3.org/2001/04/xmlenc#sha256"
+SHA384_URI = "http://www.w3.org/2001/04/xmldsig-more#sha384"
+SHA512_URI = "http://www.w3.org/2001/04/xmlenc#sha512"
+
+# PackingList hash algorithm URIs and the corresponding hashlib names
+HASH_ALGORITHMS = {
+  SHA1_URI: "sha1",
+  SHA256_URI: "sha256",
+  SHA384_URI: "sha384",
+  SHA512_URI: "sha512"
+}
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+XATTR_PREFIX = "user.repkl.digest."
+
+def default_sidecar_path() -> pathlib.Path:
+  cache_home = os.environ.get("XDG_CACHE_HOME")
+  cache_dir = pathlib.Path(cache_home) if cache_home else pathlib.Path.home().joinpath(".cache")
+  return cache_dir.joinpath("repkl", "digests.sqlite")
+
+def new_hash(algorithm: str):
+  """Returns a hashlib object for the PackingList hash algorithm URI `algorithm`."""
+  name = HASH_ALGORITHMS.get(algorithm)
+  if name is None:
+    raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+  return hashlib.new(name)
+
+def encode_digest(h) -> str:
+  return base64.b64encode(h.digest()).decode("ascii")
+
+def compute_digest(path: pathlib.Path, algorithm: str) -> str:
+  """Returns the base64-encoded digest of the file at `path`, as used in PackingLists."""
+  h = new_hash(algorithm)
+  with open(path, "rb", buffering=0) as fp:
+    buf = bytearray(READ_CHUNK_SIZE)
+    view = memoryview(buf)
+    while True:
+      n = fp.readinto(buf)
+      if n == 0:
+        break
+      h.update(view[:n])
+  return encode_digest(h)
+
+@dataclass(frozen=True)
+class CachedDigest:
+  algorithm: str
+  value: str
+  size: int
+  mtime_ns: int
+
+  def is_valid(self, st: os.stat_result) -> bool:
+    return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+class DigestCache:
+  """Persistent cache of file digests. Digests are stored in user extended attributes of the
+  file, so that they are shared by hard links, or, where extended attributes are not
+  supported, in a sidecar database keyed by device and inode. A cached digest is valid only
+  while the size and modification time of the file are unchanged."""
+
+  def __init__(self, sidecar_path: typing.Optional[pathlib.Path] = None, use_xattrs: bool = True):
+    self.sidecar_path = sidecar_path if sidecar_path is not None else default_sidecar_path()
+    self.use_xattrs = use_xattrs and hasattr(os, "setxattr")
+    self._db: typing.Optional[sqlite3.Connection] = None
+    self._lock = threading.Lock()
+
+  def _sidecar(self, create: bool = True) -> typing.Optional[sqlite3.Connection]:
+    if self._db is None:
+      if not create and not self.sidecar_path.exists():
+        return None
+      self.sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+      self._db = sqlite3.connect(str(self.sidecar_path), check_same_thread=False)
+      self._db.execute(
+        """CREATE TABLE IF NOT EXISTS digests (
+             dev INTEGER, ino INTEGER, algorithm TEXT, value TEXT, size INTEGER, mtime_ns INTEGER,
+             PRIMARY KEY (dev, ino, algorithm))"""
+      )
+    return self._db
+
+  def _read(self, path: pathlib.Path, st: os.stat_result, algorithm: str) -> typing.Optional[CachedDigest]:
+    if self.use_xattrs:
+      try:
+        entry = json.loads(os.getxattr(path, XATTR_PREFIX + HASH_ALGORITHMS[algorithm]))
+        return CachedDigest(algorithm, entry["value"], entry["size"], entry["mtime_ns"])
+      except (OSError, ValueError, KeyError):
+        pass
+
+    with self._lock:
+      db = self._sidecar(create=False)
+      if db is None:
+        return None
+      row = db.execute(
+        "SELECT value, size, mtime_ns FROM digests WHERE dev = ? AND ino = ? AND algorithm = ?",
+        (st.st_dev, st.st_ino, algorithm)
+      ).fetchone()
+
+    return CachedDigest(algorithm, *row) if row is not None else None
+
+  def get(self, path: pathlib.Path, algorithm: str) -> typing.Optional[str]:
+    """Returns the cached digest of the file at `path`, if any and still valid."""
+    st = os.stat(path)
+    entry = self._read(path, st, algorithm)
+    return entry.value if entry is not None and entry.is_valid(st) else None
+
+  def put(self, path: pathlib.Path, algorithm: str, value: str, st: typing.Optional[os.stat_result] = None):
+    """Records `value` as the digest of the file at `path`, which is described by `st`, the
+    result of a `stat` performed before the digest was computed."""
+    if st is None:
+      st = os.stat(path)
+
+    entry = {"value": value, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    if self.use_xattrs:
+      try:
+        os.setxattr(path, XATTR_PREFIX + HASH_ALGORITHMS[algorithm], json.dumps(entry).encode("utf-8"))
+        return
+      except OSError:
+        pass
+
+    with self._lock:
+      db = self._sidecar()
+      db.execute(
+        "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+        (st.st_dev, st.st_ino, algorithm, value, st.st_size, st.st_mtime_ns)
+      )
+      db.commit()
+
+  def digest(self, path: pathlib.Path, algorithm: str) -> str:
+    """Returns the digest of the file at `path`, computing and caching it if needed."""
+    st = os.stat(path)
+
+    entry = self._read(path, st, algorithm)
+    if entry is not None and entry.is_valid(st):
+      return entry.value
+
+    value = compute_digest(path, algorithm)
+    self.put(path, algorithm, value, st)
+
+    return value
+
+  def copy(self, src_path: pathlib.Path, dst_path: pathlib.Path):
+    """Transfers the valid cached digests of `src_path` to `dst_path`, which is an identical
+    copy, e.g. a reflink."""
+    src_st = os.stat(src_path)
+
+    for algorithm in HASH_ALGORITHMS:
+      entry = self._read(src_path, src_st, algorithm)
+      if entry is not None and entry.is_valid(src_st):
+        self.put(dst_path, algorithm, entry.value)
+
+  def close(self):
+    with self._lock:
+      if self._db is not None:
+        self._db.close()
+        self._db = None
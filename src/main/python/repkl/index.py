@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""On-disk index of the assets of a collection of Mapped File Sets.
+
+The index file consists of:
+
+* a header: magic, version, record count, and the offset and length of the root table;
+* a key table: one entry per asset copy, sorted by key, consisting of the 128-bit UUID of the
+  asset (big-endian) and the offset of its record;
+* a record area, where each record holds the index of its root in the root table, the size of
+  the asset, flags and a list of length-prefixed UTF-8 strings (AssetMap path and PackingList
+  fields);
+* the root table: a JSON list of the indexed Mapped File Sets and the fingerprints of their
+  AssetMaps.
+
+Lookups perform a binary search of the key table over a memory map of the file, so that opening
+the index does not require reading it.
+"""
+
+from __future__ import annotations
+import os
+import io
+import json
+import mmap
+import struct
+import uuid
+import typing
+import pathlib
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+import repkl.assetmap
+import repkl.pkl
+import repkl.storage
+
+LOGGER = logging.getLogger("repkl")
+
+MAGIC = b"REPKLIDX"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIQQQ")
+KEY_ENTRY = struct.Struct("<16sQ")
+RECORD_HEADER = struct.Struct("<IQB")
+STRING_LENGTH = struct.Struct("<I")
+
+NONE_STRING_LENGTH = 0xFFFFFFFF
+
+FLAG_IS_PKL = 0x01
+FLAG_HAS_PKL_ASSET = 0x02
+
+@dataclass(frozen=True)
+class IndexRecord:
+  root: str
+  am_asset: repkl.assetmap.Asset
+  pkl_asset: typing.Optional[repkl.pkl.Asset]
+
+def _asset_key(asset_id: str) -> typing.Optional[bytes]:
+  try:
+    return uuid.UUID(asset_id).bytes
+  except ValueError:
+    return None
+
+def _pack_strings(strings: typing.Iterable[typing.Optional[str]]) -> bytes:
+  buf = io.BytesIO()
+  for s in strings:
+    if s is None:
+      buf.write(STRING_LENGTH.pack(NONE_STRING_LENGTH))
+    else:
+      b = s.encode("utf-8")
+      buf.write(STRING_LENGTH.pack(len(b)))
+      buf.write(b)
+  return buf.getvalue()
+
+def _pack_record(root_index: int, am_asset: repkl.assetmap.Asset, pkl_asset: typing.Optional[repkl.pkl.Asset]) -> bytes:
+  flags = (FLAG_IS_PKL if am_asset.is_pkl else 0) | (FLAG_HAS_PKL_ASSET if pkl_asset is not None else 0)
+
+  if pkl_asset is None:
+    return RECORD_HEADER.pack(root_index, 0, flags) + _pack_strings((am_asset.path,))
+
+  return RECORD_HEADER.pack(root_index, pkl_asset.size, flags) + _pack_strings((
+    am_asset.path,
+    pkl_asset.hash,
+    pkl_asset.hash_algorithm,
+    pkl_asset.type,
+    pkl_asset.annotation_text,
+    pkl_asset.annotation_text_lang,
+    pkl_asset.original_filename,
+    pkl_asset.original_filename_lang
+  ))
+
+def fingerprint_mapped_file_set(storage: repkl.storage.Storage) -> typing.Optional[typing.List[int]]:
+  # unchanged AssetMaps are not parsed again when the index is refreshed
+  if not isinstance(storage, repkl.storage.LocalStorage):
+    return None
+  st = storage.path(repkl.assetmap.ASSETMAP_FILENAME).stat()
+  return [st.st_size, st.st_mtime_ns]
+
+def scan_mapped_file_set(storage: repkl.storage.Storage,
+                         pkl_assets: typing.Optional[typing.Dict[str, repkl.pkl.Asset]] = None
+                        ) -> typing.List[typing.Tuple[repkl.assetmap.Asset, typing.Optional[repkl.pkl.Asset]]]:
+  """Returns the AssetMap and PackingList entries of every asset present in a Mapped File Set. The
+  entries of all the PackingLists present, including entries for assets stored on other volumes of
+  the Mapped File Set, are added to `pkl_assets`."""
+
+  am = repkl.assetmap.AssetMap.from_element(ET.fromstring(storage.read_bytes(repkl.assetmap.ASSETMAP_FILENAME)))
+
+  # only the assets stored on this volume of a multi-volume Mapped File Set are present
+
+  if am.volume_count > 1:
+    volume_index = repkl.assetmap.VolumeIndex.from_element(
+      ET.fromstring(storage.read_bytes(repkl.assetmap.VOLINDEX_FILENAME))
+    ).index
+    am.assets = [a for a in am.assets if a.volume_index in (None, volume_index)]
+
+  local_pkl_assets: typing.Dict[str, repkl.pkl.Asset] = {}
+  for pkl_entry in filter(lambda x: x.is_pkl, am.assets):
+    pkl = repkl.pkl.PackingList.from_element(ET.fromstring(storage.read_bytes(pkl_entry.path)))
+    local_pkl_assets.update({a.id: a for a in pkl.assets})
+
+  if pkl_assets is not None:
+    pkl_assets.update(local_pkl_assets)
+
+  return [(a, local_pkl_assets.get(a.id)) for a in am.assets]
+
+class AssetIndex:
+  """Read-only view of an index file."""
+
+  def __init__(self, path: pathlib.Path):
+    self.path = path
+
+    with open(path, "rb") as fp:
+      self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, self._count, roots_offset, roots_length = HEADER.unpack_from(self._mm, 0)
+
+    if magic != MAGIC or version != VERSION:
+      self._mm.close()
+      raise ValueError(f"{path} is not a repkl index")
+
+    self._roots = json.loads(self._mm[roots_offset:roots_offset + roots_length].decode("utf-8"))
+
+  def __enter__(self) -> AssetIndex:
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self) -> int:
+    return self._count
+
+  def close(self):
+    self._mm.close()
+
+  @property
+  def roots(self) -> typing.List[str]:
+    return [r["location"] for r in self._roots]
+
+  def _key(self, i: int) -> bytes:
+    offset = HEADER.size + i * KEY_ENTRY.size
+    return self._mm[offset:offset + 16]
+
+  def _read_strings(self, offset: int, count: int) -> typing.Tuple[typing.List[typing.Optional[str]], int]:
+    strings = []
+    for _ in range(count):
+      (length,) = STRING_LENGTH.unpack_from(self._mm, offset)
+      offset += STRING_LENGTH.size
+      if length == NONE_STRING_LENGTH:
+        strings.append(None)
+      else:
+        strings.append(self._mm[offset:offset + length].decode("utf-8"))
+        offset += length
+    return (strings, offset)
+
+  def _record(self, i: int) -> IndexRecord:
+    key, offset = KEY_ENTRY.unpack_from(self._mm, HEADER.size + i * KEY_ENTRY.size)
+    asset_id = f"urn:uuid:{uuid.UUID(bytes=key)}"
+
+    root_index, size, flags = RECORD_HEADER.unpack_from(self._mm, offset)
+    offset += RECORD_HEADER.size
+
+    if flags & FLAG_HAS_PKL_ASSET:
+      (path, hash_value, hash_algorithm, asset_type, annotation_text, annotation_text_lang,
+        original_filename, original_filename_lang), _ = self._read_strings(offset, 8)
+
+      pkl_asset = repkl.pkl.Asset(
+        id=asset_id,
+        annotation_text=annotation_text,
+        annotation_text_lang=annotation_text_lang,
+        hash=hash_value,
+        size=size,
+        type=asset_type,
+        original_filename=original_filename,
+        original_filename_lang=original_filename_lang,
+        hash_algorithm=hash_algorithm
+      )
+    else:
+      (path,), _ = self._read_strings(offset, 1)
+      pkl_asset = None
+
+    return IndexRecord(
+      root=self._roots[root_index]["location"],
+      am_asset=repkl.assetmap.Asset(id=asset_id, path=path, is_pkl=bool(flags & FLAG_IS_PKL)),
+      pkl_asset=pkl_asset
+    )
+
+  def lookup(self, asset_id: str) -> typing.List[IndexRecord]:
+    """Returns all the indexed copies of the asset `asset_id`."""
+
+    key = _asset_key(asset_id)
+    if key is None:
+      return []
+
+    # leftmost entry whose key is not less than the asset key
+
+    lo = 0
+    hi = self._count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._key(mid) < key:
+        lo = mid + 1
+      else:
+        hi = mid
+
+    records = []
+    while lo < self._count and self._key(lo) == key:
+      records.append(self._record(lo))
+      lo += 1
+
+    return records
+
+  def records(self) -> typing.Iterator[IndexRecord]:
+    for i in range(self._count):
+      yield self._record(i)
+
+  def fingerprint(self, root: str) -> typing.Optional[typing.List[int]]:
+    return next((r.get("fingerprint") for r in self._roots if r["location"] == root), None)
+
+def write_index(path: pathlib.Path,
+                roots: typing.List[typing.Tuple[str, typing.Optional[typing.List[int]]]],
+                records: typing.Iterable[typing.Tuple[int, repkl.assetmap.Asset, typing.Optional[repkl.pkl.Asset]]]):
+  """Writes an index file atomically. `roots` lists the location and fingerprint of each Mapped
+  File Set and each record refers to its Mapped File Set by its position in `roots`."""
+
+  entries = []
+  for root_index, am_asset, pkl_asset in records:
+    key = _asset_key(am_asset.id)
+    if key is None:
+      LOGGER.warning("Skipping asset %s in %s: its Id is not a UUID", am_asset.id, roots[root_index][0])
+      continue
+    entries.append((key, _pack_record(root_index, am_asset, pkl_asset)))
+
+  entries.sort(key=lambda e: e[0])
+
+  record_offset = HEADER.size + len(entries) * KEY_ENTRY.size
+  roots_data = json.dumps([{"location": loc, "fingerprint": fp} for loc, fp in roots]).encode("utf-8")
+  roots_offset = record_offset + sum(len(r) for _, r in entries)
+
+  tmp_path = path.with_name(path.name + ".tmp")
+
+  with open(tmp_path, "wb") as fp:
+    fp.write(HEADER.pack(MAGIC, VERSION, len(entries), roots_offset, len(roots_data)))
+
+    offset = record_offset
+    for key, record in entries:
+      fp.write(KEY_ENTRY.pack(key, offset))
+      offset += len(record)
+
+    for _, record in entries:
+      fp.write(record)
+
+    fp.write(roots_data)
+
+  os.replace(tmp_path, path)
+
+def build_index(path: pathlib.Path,
+                mapped_file_sets: typing.Iterable[repkl.storage.Storage],
+                refresh: bool = False,
+                storage_options: typing.Optional[typing.Mapping[str, typing.Any]] = None):
+  """Builds the index file at `path` from `mapped_file_sets`. If `refresh` is true, the Mapped File
+  Sets of the existing index are also indexed, and their records are reused if their AssetMap is
+  unchanged. Mapped File Sets that no longer exist are dropped."""
+
+  storage_options = storage_options if storage_options is not None else {}
+
+  storages = {s.location: s for s in mapped_file_sets}
+
+  old_index = AssetIndex(path) if refresh and path.exists() else None
+
+  try:
+    if old_index is not None:
+      for root in old_index.roots:
+        if root not in storages:
+          storages[root] = repkl.storage.open_storage(root, **storage_options)
+
+    roots = []
+    records = []
+    reused_roots: typing.Dict[str, int] = {}
+    pkl_assets: typing.Dict[str, repkl.pkl.Asset] = {}
+
+    for location, storage in storages.items():
+      try:
+        fingerprint = fingerprint_mapped_file_set(storage)
+      except OSError:
+        LOGGER.warning("Dropping %s from the index: no AssetMap found", location)
+        continue
+
+      root_index = len(roots)
+      roots.append((location, fingerprint))
+
+      if old_index is not None and fingerprint is not None and old_index.fingerprint(location) == fingerprint:
+        LOGGER.info("Reusing index records of %s", location)
+        reused_roots[location] = root_index
+      else:
+        LOGGER.info("Indexing %s", location)
+        records.extend(
+          (root_index, am_asset, pkl_asset) for am_asset, pkl_asset in scan_mapped_file_set(storage, pkl_assets)
+        )
+
+    if len(reused_roots) > 0:
+      records.extend(
+        (reused_roots[r.root], r.am_asset, r.pkl_asset) for r in old_index.records() if r.root in reused_roots
+      )
+
+  finally:
+    if old_index is not None:
+      old_index.close()
+
+  # assets stored on a different volume than their PackingList
+
+  records = [(r, a, p if p is not None else pkl_assets.get(a.id)) for r, a, p in records]
+
+  write_index(path, roots, records)
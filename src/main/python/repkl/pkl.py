@@ -84,7 +84,7 @@ class Asset:
 
     asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}Id", self.id))
     if self.annotation_text is not None:
-      asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}Type", self.annotation_text, self.annotation_text_lang))
+      asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}AnnotationText", self.annotation_text, self.annotation_text_lang))
     asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}Hash", self.hash))
     asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}Size", str(self.size)))
     asset_elem.append(make_text_element(f"{{{PKL2016_NS}}}Type", self.type))
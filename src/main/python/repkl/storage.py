@@ -0,0 +1,1136 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import annotations
+import pathlib
+import typing
+import shutil
+import os
+import io
+import hmac
+import hashlib
+import datetime
+import time
+import enum
+import secrets
+import stat
+import ctypes
+import ctypes.util
+import tarfile
+import threading
+import http.client
+import urllib.parse
+import xml.etree.ElementTree as ET
+import collections
+import concurrent.futures
+import re
+import logging
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+import repkl.digest
+from repkl.utils import get_ns
+
+LOGGER = logging.getLogger("repkl")
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+# smallest part, other than the last, that S3 accepts in a multipart upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Linux ioctl that clones the extents of a file (reflink)
+FICLONE = 0x40049409
+
+def _clone_file(src_path: pathlib.Path, dst_path: pathlib.Path) -> bool:
+  # attempts a copy-on-write clone, which succeeds only within a filesystem that supports it
+  if fcntl is None:
+    return False
+  with src_path.open("rb") as src_fp, dst_path.open("wb") as dst_fp:
+    try:
+      fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+    except OSError:
+      return False
+  return True
+
+class Durability(enum.Enum):
+  NONE = "none"           # leave writeback to the operating system
+  BATCH = "batch"         # sync the destination once, after all files are written
+  PER_FILE = "per-file"   # sync each file after it is written
+
+_libc = None
+
+def _syncfs(path: pathlib.Path) -> bool:
+  # flushes the whole filesystem containing `path` (Linux only), returning False if unavailable
+  global _libc
+  if _libc is None:
+    lib_name = ctypes.util.find_library("c")
+    try:
+      _libc = ctypes.CDLL(lib_name, use_errno=True) if lib_name is not None else False
+    except OSError:
+      _libc = False
+  if _libc is False or not hasattr(_libc, "syncfs"):
+    return False
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    if _libc.syncfs(fd) != 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno), str(path))
+  finally:
+    os.close(fd)
+  return True
+
+def _fsync_path(path: pathlib.Path):
+  # directories cannot be opened, and need not be synced, on some platforms
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except (IsADirectoryError, PermissionError):
+    return
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def _abort_writer(fp: typing.BinaryIO):
+  # writers of streaming storages discard, rather than finish, a file whose copy failed
+  abort = getattr(fp, "abort", None)
+  if abort is not None:
+    abort()
+  else:
+    fp.close()
+
+class _SyncedFile(io.FileIO):
+
+  def close(self):
+    if not self.closed:
+      os.fsync(self.fileno())
+    super().close()
+
+class Storage:
+  """Location from which a mapped file set is read or to which one is written. Paths
+  are relative to the root of the location and use '/' as separator."""
+
+  @property
+  def key(self) -> typing.Hashable:
+    raise NotImplementedError
+
+  def __eq__(self, other) -> bool:
+    return isinstance(other, Storage) and self.key == other.key
+
+  @property
+  def read_only(self) -> bool:
+    # read-only storages cannot be destinations
+    return False
+
+  def __hash__(self) -> int:
+    return hash(self.key)
+
+  def __str__(self) -> str:
+    return str(self.key)
+
+  @property
+  def location(self) -> str:
+    # location from which `open_storage` recreates the storage
+    raise NotImplementedError
+
+  def open(self, path: str) -> typing.BinaryIO:
+    raise NotImplementedError
+
+  def read_bytes(self, path: str) -> bytes:
+    with self.open(path) as fp:
+      return fp.read()
+
+  def iter_chunks(self, path: str, size: int) -> typing.Iterator[bytes]:
+    # successive chunks of the file, which is `size` bytes long
+    with self.open(path) as fp:
+      yield from iter(lambda: fp.read(COPY_CHUNK_SIZE), b"")
+
+  def read_range(self, path: str, offset: int, length: int) -> bytes:
+    with self.open(path) as fp:
+      fp.seek(offset)
+      return fp.read(length)
+
+  def size(self, path: str) -> int:
+    raise NotImplementedError
+
+  def device(self, path: str) -> typing.Optional[int]:
+    # identifier of the local device that holds the file, if any
+    return None
+
+  def digest(self, path: str, algorithm: str, cache: typing.Optional[repkl.digest.DigestCache] = None) -> str:
+    h = repkl.digest.new_hash(algorithm)
+    with self.open(path) as fp:
+      for chunk in iter(lambda: fp.read(COPY_CHUNK_SIZE), b""):
+        h.update(chunk)
+    return repkl.digest.encode_digest(h)
+
+  def cached_digest(self, path: str, algorithm: str, cache: typing.Optional[repkl.digest.DigestCache] = None) -> typing.Optional[str]:
+    return None
+
+  def is_empty(self) -> bool:
+    raise NotImplementedError
+
+  def write_bytes(self, path: str, data: bytes):
+    with self.open_write(path, len(data)) as fp:
+      fp.write(data)
+
+  def open_write(self, path: str, size: int) -> typing.BinaryIO:
+    raise NotImplementedError
+
+  def put_file(self, path: str, src: Storage, src_path: str, size: int,
+               digest_algorithms: typing.Collection[str] = ()) -> typing.Dict[str, str]:
+    # copies the file, returning the digests, computed inline, for each of `digest_algorithms`
+
+    hashes = {a: repkl.digest.new_hash(a) for a in digest_algorithms}
+
+    dst_fp = self.open_write(path, size)
+    try:
+      for chunk in src.iter_chunks(src_path, size):
+        for h in hashes.values():
+          h.update(chunk)
+        dst_fp.write(chunk)
+    except BaseException:
+      _abort_writer(dst_fp)
+      raise
+    dst_fp.close()
+
+    return {a: repkl.digest.encode_digest(h) for a, h in hashes.items()}
+
+  def move_file(self, path: str, src: Storage, src_path: str):
+    raise ValueError(f"Moving assets to {self} is not supported")
+
+  def symlink_file(self, path: str, src: Storage, src_path: str):
+    raise ValueError(f"Symlinking assets to {self} is not supported")
+
+  def sync(self):
+    # makes all files written so far durable
+    pass
+
+  def close(self):
+    pass
+
+  def abort(self):
+    # releases the storage after a failed transfer, without finishing what was being written
+    self.close()
+
+class LocalStorage(Storage):
+  """Files under a local directory. Files are written atomically by way of a temporary file, and
+  are synced to stable storage according to `durability`, either as they are written or, for
+  `Durability.BATCH`, once when the storage is closed."""
+
+  def __init__(self, root: pathlib.Path, durability: Durability = Durability.NONE):
+    self.root = pathlib.Path(root)
+    self.durability = durability
+    self._unsynced: typing.List[pathlib.Path] = []
+
+  @property
+  def key(self) -> typing.Hashable:
+    return ("file", str(self.root.resolve()))
+
+  def __str__(self) -> str:
+    return str(self.root)
+
+  @property
+  def location(self) -> str:
+    return str(self.root.resolve())
+
+  def path(self, path: str) -> pathlib.Path:
+    return self.root.joinpath(path)
+
+  def open(self, path: str) -> typing.BinaryIO:
+    return self.path(path).open("rb")
+
+  def size(self, path: str) -> int:
+    return self.path(path).stat().st_size
+
+  def device(self, path: str) -> typing.Optional[int]:
+    return self.path(path).stat().st_dev
+
+  def digest(self, path: str, algorithm: str, cache: typing.Optional[repkl.digest.DigestCache] = None) -> str:
+    if cache is None:
+      return repkl.digest.compute_digest(self.path(path), algorithm)
+    return cache.digest(self.path(path), algorithm)
+
+  def cached_digest(self, path: str, algorithm: str, cache: typing.Optional[repkl.digest.DigestCache] = None) -> typing.Optional[str]:
+    return cache.get(self.path(path), algorithm) if cache is not None else None
+
+  def is_empty(self) -> bool:
+    return next(self.root.iterdir(), None) is None
+
+  def _written(self, path: pathlib.Path):
+    if self.durability is Durability.PER_FILE:
+      _fsync_path(path)
+    elif self.durability is Durability.BATCH:
+      self._unsynced.append(path)
+
+  def write_bytes(self, path: str, data: bytes):
+    # the file is replaced atomically so that readers never see a partially written file
+    dst_path = self.path(path)
+
+    # the file keeps the mode of the file it replaces, or is otherwise created under the umask
+    try:
+      mode = stat.S_IMODE(dst_path.stat().st_mode)
+    except FileNotFoundError:
+      mode = None
+
+    tmp_path = dst_path.parent.joinpath(f".{dst_path.name}.{secrets.token_hex(8)}.tmp")
+    fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+      with os.fdopen(fd, "wb") as fp:
+        if mode is not None:
+          os.chmod(tmp_path, mode)
+        fp.write(data)
+        if self.durability is not Durability.NONE:
+          fp.flush()
+          os.fsync(fp.fileno())
+      os.replace(tmp_path, dst_path)
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+    # manifests are written after the assets are synced, and are made durable as soon as they are written
+    if self.durability is not Durability.NONE:
+      _fsync_path(dst_path.parent)
+
+  def open_write(self, path: str, size: int) -> typing.BinaryIO:
+    if self.durability is Durability.PER_FILE:
+      return io.BufferedWriter(_SyncedFile(self.path(path), "w"))
+    self._written(self.path(path))
+    return self.path(path).open("wb")
+
+  def put_file(self, path: str, src: Storage, src_path: str, size: int,
+               digest_algorithms: typing.Collection[str] = ()) -> typing.Dict[str, str]:
+    if isinstance(src, LocalStorage) and len(digest_algorithms) == 0:
+      if not _clone_file(src.path(src_path), self.path(path)):
+        shutil.copyfile(src.path(src_path), self.path(path))
+      self._written(self.path(path))
+      return {}
+
+    if isinstance(src, HTTPStorage) and len(digest_algorithms) == 0:
+      src.download(src_path, self.path(path), size)
+      self._written(self.path(path))
+      return {}
+
+    return super().put_file(path, src, src_path, size, digest_algorithms)
+
+  def sync(self):
+    # makes all files written so far durable, using a single syncfs() call where available
+    if self.durability is Durability.BATCH:
+      if not _syncfs(self.root):
+        for p in self._unsynced:
+          _fsync_path(p)
+        _fsync_path(self.root)
+      self._unsynced = []
+    elif self.durability is Durability.PER_FILE:
+      _fsync_path(self.root)
+
+  def close(self):
+    self.sync()
+
+  def move_file(self, path: str, src: Storage, src_path: str):
+    if not isinstance(src, LocalStorage):
+      raise ValueError(f"Cannot move assets from {src} to {self}")
+    shutil.move(src.path(src_path), self.path(path))
+    self._written(self.path(path))
+
+  def symlink_file(self, path: str, src: Storage, src_path: str):
+    if not isinstance(src, LocalStorage):
+      raise ValueError(f"Cannot symlink assets from {src} to {self}")
+    self.path(path).symlink_to(src.path(src_path).resolve())
+
+class TarStorage(Storage):
+  """Writes a mapped file set as a tar stream, e.g. to stdout. Members are written in
+  order and each member is streamed directly after its header, which requires its size to
+  be known in advance."""
+
+  def __init__(self, fileobj: typing.BinaryIO, close_fileobj: bool = False):
+    self.fileobj = fileobj
+    self.close_fileobj = close_fileobj
+    self._member: typing.Optional[_TarMemberWriter] = None
+    self._closed = False
+
+  @property
+  def key(self) -> typing.Hashable:
+    return ("tar", id(self.fileobj))
+
+  def __str__(self) -> str:
+    return getattr(self.fileobj, "name", "tar stream")
+
+  def is_empty(self) -> bool:
+    return True
+
+  def open_write(self, path: str, size: int) -> typing.BinaryIO:
+    if self._member is not None and not self._member.closed:
+      raise ValueError("Only one tar member can be written at a time")
+
+    info = tarfile.TarInfo(path)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    self.fileobj.write(info.tobuf(tarfile.PAX_FORMAT))
+
+    self._member = _TarMemberWriter(self.fileobj, path, size)
+    return self._member
+
+  def close(self):
+    if self._closed:
+      return
+
+    self._closed = True
+
+    # end-of-archive marker, padded to a full record
+    self.fileobj.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    self.fileobj.write(tarfile.NUL * (tarfile.RECORDSIZE - 2 * tarfile.BLOCKSIZE))
+    self.fileobj.flush()
+
+    if self.close_fileobj:
+      self.fileobj.close()
+
+  def abort(self):
+    # the stream is left truncated, without an end-of-archive marker, so that readers fail rather than
+    # extract a partial member
+    if self._closed:
+      return
+
+    self._closed = True
+
+    if self.close_fileobj:
+      self.fileobj.close()
+    else:
+      self.fileobj.flush()
+
+class _TarMemberWriter(io.RawIOBase):
+
+  def __init__(self, fileobj: typing.BinaryIO, path: str, size: int):
+    super().__init__()
+    self._fileobj = fileobj
+    self._path = path
+    self._size = size
+    self._written = 0
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, b) -> int:
+    n = len(b)
+    if self._written + n > self._size:
+      raise ValueError(f"{self._path} is larger than its declared size of {self._size} bytes")
+    self._fileobj.write(b)
+    self._written += n
+    return n
+
+  def close(self):
+    if self.closed:
+      return
+
+    super().close()
+
+    if self._written != self._size:
+      raise ValueError(f"{self._path} is {self._written} bytes instead of its declared size of {self._size} bytes")
+
+    remainder = self._size % tarfile.BLOCKSIZE
+    if remainder > 0:
+      self._fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+  def abort(self):
+    # the member is left incomplete, without padding
+    super().close()
+
+class FanOutStorage(Storage):
+  """Writes identical content to several storages. Each file is read once and each buffer is
+  written to all storages in parallel before the next buffer is read."""
+
+  def __init__(self, storages: typing.List[Storage]):
+    self.storages = storages
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(storages))
+
+  @property
+  def key(self) -> typing.Hashable:
+    return ("fanout",) + tuple(s.key for s in self.storages)
+
+  def __str__(self) -> str:
+    return ", ".join(str(s) for s in self.storages)
+
+  def _map(self, fn: typing.Callable[[Storage], typing.Any]) -> typing.List[typing.Any]:
+    return list(self._executor.map(fn, self.storages))
+
+  def is_empty(self) -> bool:
+    return all(self._map(lambda s: s.is_empty()))
+
+  def write_bytes(self, path: str, data: bytes):
+    self._map(lambda s: s.write_bytes(path, data))
+
+  def open_write(self, path: str, size: int) -> typing.BinaryIO:
+    return _FanOutWriter(self._executor, self._map(lambda s: s.open_write(path, size)))
+
+  def symlink_file(self, path: str, src: Storage, src_path: str):
+    self._map(lambda s: s.symlink_file(path, src, src_path))
+
+  def sync(self):
+    self._map(lambda s: s.sync())
+
+  def close(self):
+    try:
+      self._map(lambda s: s.close())
+    finally:
+      self._executor.shutdown()
+
+  def abort(self):
+    try:
+      self._map(lambda s: s.abort())
+    finally:
+      self._executor.shutdown()
+
+class _FanOutWriter(io.RawIOBase):
+
+  def __init__(self, executor: concurrent.futures.Executor, writers: typing.List[typing.BinaryIO]):
+    super().__init__()
+    self._executor = executor
+    self._writers = writers
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, b) -> int:
+    list(self._executor.map(lambda w: w.write(b), self._writers))
+    return len(b)
+
+  def close(self):
+    if self.closed:
+      return
+    super().close()
+    list(self._executor.map(lambda w: w.close(), self._writers))
+
+  def abort(self):
+    if self.closed:
+      return
+    super().close()
+    list(self._executor.map(_abort_writer, self._writers))
+
+class _ConnectionPool:
+  """Keep-alive connections to an HTTP(S) host. At most `size` connections are open at once: each
+  request checks out an idle connection, or opens one, and returns it once its response is read."""
+
+  def __init__(self, scheme: str, host: str, size: int):
+    self.scheme = scheme
+    self.host = host
+    self._slots = threading.BoundedSemaphore(size)
+    self._idle: typing.List[http.client.HTTPConnection] = []
+    self._lock = threading.Lock()
+
+  def new_connection(self) -> http.client.HTTPConnection:
+    if self.scheme == "https":
+      return http.client.HTTPSConnection(self.host)
+    return http.client.HTTPConnection(self.host)
+
+  def request(self, send: typing.Callable[[http.client.HTTPConnection], http.client.HTTPResponse]
+              ) -> typing.Tuple[http.client.HTTPResponse, bytes]:
+    """Sends a request using `send` and returns its response, together with its body."""
+
+    with self._slots:
+      with self._lock:
+        conn = self._idle.pop() if len(self._idle) > 0 else None
+      if conn is None:
+        conn = self.new_connection()
+
+      try:
+        resp = send(conn)
+        body = resp.read()
+      except BaseException:
+        conn.close()
+        raise
+
+      if resp.will_close:
+        conn.close()
+      else:
+        with self._lock:
+          self._idle.append(conn)
+
+    return (resp, body)
+
+  def stream(self, send: typing.Callable[[http.client.HTTPConnection], http.client.HTTPResponse]) -> typing.BinaryIO:
+    """Sends a request using `send` and returns its streamed body, which holds its own connection
+    until it is closed."""
+
+    conn = self.new_connection()
+    try:
+      resp = send(conn)
+    except BaseException:
+      conn.close()
+      raise
+    return io.BufferedReader(_ResponseReader(conn, resp), COPY_CHUNK_SIZE)
+
+  def close(self):
+    with self._lock:
+      for conn in self._idle:
+        conn.close()
+      self._idle.clear()
+
+class S3Error(OSError):
+  pass
+
+def _uri_encode(s: str, safe: str = "-_.~") -> str:
+  return urllib.parse.quote(s, safe=safe)
+
+def _hmac_sha256(key: bytes, msg: str) -> bytes:
+  return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+class S3Storage(Storage):
+  """S3-compatible object storage, addressed using path-style requests and authenticated
+  using AWS Signature Version 4. Assets larger than `part_size` are uploaded as
+  multipart uploads with up to `concurrency` parts in flight. `part_size` must be at least
+  `min_part_size`, which defaults to the S3 limit of `MIN_PART_SIZE`."""
+
+  def __init__(self,
+               bucket: str,
+               prefix: str = "",
+               endpoint: typing.Optional[str] = None,
+               region: typing.Optional[str] = None,
+               access_key: typing.Optional[str] = None,
+               secret_key: typing.Optional[str] = None,
+               session_token: typing.Optional[str] = None,
+               part_size: int = DEFAULT_PART_SIZE,
+               concurrency: int = DEFAULT_CONCURRENCY,
+               min_part_size: typing.Optional[int] = None):
+
+    min_part_size = min_part_size if min_part_size is not None else MIN_PART_SIZE
+
+    if part_size <= 0:
+      raise ValueError("Part size must be positive")
+    if part_size < min_part_size:
+      raise ValueError(f"Part size must be at least {min_part_size} bytes")
+    if concurrency <= 0:
+      raise ValueError("Concurrency must be positive")
+
+    self.bucket = bucket
+    self.prefix = prefix.strip("/")
+    self.region = region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+    self.endpoint = endpoint or os.environ.get("AWS_ENDPOINT_URL") or f"https://s3.{self.region}.amazonaws.com"
+    self.access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID")
+    self.secret_key = secret_key or os.environ.get("AWS_SECRET_ACCESS_KEY")
+    self.session_token = session_token or os.environ.get("AWS_SESSION_TOKEN")
+    self.part_size = part_size
+    self.concurrency = concurrency
+
+    endpoint_url = urllib.parse.urlsplit(self.endpoint)
+    if endpoint_url.scheme not in ("http", "https"):
+      raise ValueError(f"Unsupported S3 endpoint: {self.endpoint}")
+    self._host = endpoint_url.netloc
+    self._pool = _ConnectionPool(endpoint_url.scheme, self._host, concurrency)
+
+  @property
+  def key(self) -> typing.Hashable:
+    return ("s3", self.endpoint, self.bucket, self.prefix)
+
+  def __str__(self) -> str:
+    return f"s3://{self.bucket}/{self.prefix}"
+
+  @property
+  def location(self) -> str:
+    return str(self)
+
+  def _object_key(self, path: str) -> str:
+    return f"{self.prefix}/{path}" if len(self.prefix) > 0 else path
+
+  def _sign(self, method: str, uri: str, query: typing.Mapping[str, str], headers: typing.Dict[str, str]):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    scope_date = now.strftime("%Y%m%d")
+
+    headers["host"] = self._host
+    headers["x-amz-date"] = amz_date
+    headers["x-amz-content-sha256"] = "UNSIGNED-PAYLOAD"
+    if self.session_token is not None:
+      headers["x-amz-security-token"] = self.session_token
+
+    if self.access_key is None or self.secret_key is None:
+      return
+
+    signed_headers = sorted(k.lower() for k in headers)
+    canonical_headers = "".join(f"{k}:{str(headers[k]).strip()}\n" for k in signed_headers)
+    canonical_query = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items()))
+
+    canonical_request = "\n".join((
+      method,
+      uri,
+      canonical_query,
+      canonical_headers,
+      ";".join(signed_headers),
+      "UNSIGNED-PAYLOAD"
+    ))
+
+    scope = f"{scope_date}/{self.region}/s3/aws4_request"
+    string_to_sign = "\n".join((
+      "AWS4-HMAC-SHA256",
+      amz_date,
+      scope,
+      hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+    ))
+
+    signing_key = _hmac_sha256(f"AWS4{self.secret_key}".encode("utf-8"), scope_date)
+    signing_key = _hmac_sha256(signing_key, self.region)
+    signing_key = _hmac_sha256(signing_key, "s3")
+    signing_key = _hmac_sha256(signing_key, "aws4_request")
+    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    headers["Authorization"] = (
+      f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+      f"SignedHeaders={';'.join(signed_headers)}, Signature={signature}"
+    )
+
+  def _send(self, conn: http.client.HTTPConnection, method: str, object_key: typing.Optional[str],
+            query: typing.Optional[typing.Mapping[str, str]] = None, headers: typing.Optional[typing.Mapping[str, str]] = None,
+            body: typing.Optional[bytes] = None) -> http.client.HTTPResponse:
+    query = dict(query) if query is not None else {}
+    headers = {k.lower(): v for k, v in headers.items()} if headers is not None else {}
+
+    uri = "/" + _uri_encode(self.bucket)
+    if object_key is not None:
+      uri += "/" + _uri_encode(object_key, safe="-_.~/")
+
+    self._sign(method, uri, query, headers)
+
+    if len(query) > 0:
+      uri += "?" + "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(query.items()))
+
+    conn.request(method, uri, body=body if body is not None else b"", headers=headers)
+    resp = conn.getresponse()
+
+    if resp.status >= 300:
+      msg = resp.read()
+      raise S3Error(f"{method} {uri} failed with status {resp.status}: {msg[:512]!r}")
+
+    return resp
+
+  def _request(self, method: str, object_key: typing.Optional[str], **kwargs) -> typing.Tuple[http.client.HTTPResponse, bytes]:
+    return self._pool.request(lambda conn: self._send(conn, method, object_key, **kwargs))
+
+  def open(self, path: str) -> typing.BinaryIO:
+    return self._pool.stream(lambda conn: self._send(conn, "GET", self._object_key(path)))
+
+  def read_bytes(self, path: str) -> bytes:
+    return self._request("GET", self._object_key(path))[1]
+
+  def read_range(self, path: str, offset: int, length: int) -> bytes:
+    return self._request(
+      "GET",
+      self._object_key(path),
+      headers={"Range": f"bytes={offset}-{offset + length - 1}"}
+    )[1]
+
+  def size(self, path: str) -> int:
+    resp, _ = self._request("HEAD", self._object_key(path))
+    return int(resp.getheader("Content-Length"))
+
+  def is_empty(self) -> bool:
+    query = {"list-type": "2", "max-keys": "1"}
+    if len(self.prefix) > 0:
+      query["prefix"] = self.prefix + "/"
+
+    _, body = self._request("GET", None, query=query)
+    root = ET.fromstring(body)
+    ns = {"s3": get_ns(root)}
+
+    return len(root.findall("s3:Contents", ns)) == 0
+
+  def write_bytes(self, path: str, data: bytes):
+    self._request("PUT", self._object_key(path), body=data)
+
+  def open_write(self, path: str, size: int) -> typing.BinaryIO:
+    return _S3Writer(self, path)
+
+  def _create_multipart_upload(self, object_key: str) -> str:
+    _, body = self._request("POST", object_key, query={"uploads": ""})
+    root = ET.fromstring(body)
+    return root.find("s3:UploadId", {"s3": get_ns(root)}).text
+
+  def _upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes) -> str:
+    resp, _ = self._request(
+      "PUT",
+      object_key,
+      query={"partNumber": str(part_number), "uploadId": upload_id},
+      body=data
+    )
+    return resp.getheader("ETag")
+
+  def _complete_multipart_upload(self, object_key: str, upload_id: str, etags: typing.List[str]):
+    parts = "".join(
+      f"<Part><PartNumber>{i + 1}</PartNumber><ETag>{etag}</ETag></Part>" for i, etag in enumerate(etags)
+    )
+    self._request(
+      "POST",
+      object_key,
+      query={"uploadId": upload_id},
+      body=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+    )
+
+  def close(self):
+    self._pool.close()
+
+  def _abort_multipart_upload(self, object_key: str, upload_id: str):
+    # uploads are aborted once a transfer has failed, whose error must not be hidden by that of the abort
+    try:
+      self._request("DELETE", object_key, query={"uploadId": upload_id})
+    except Exception as e: # pylint: disable=broad-except
+      LOGGER.warning("Cannot abort the multipart upload of s3://%s/%s: %s", self.bucket, object_key, e)
+
+  def put_file(self, path: str, src: Storage, src_path: str, size: int,
+               digest_algorithms: typing.Collection[str] = ()) -> typing.Dict[str, str]:
+    if len(digest_algorithms) > 0:
+      # parts are still uploaded in parallel, but are read in order
+      return super().put_file(path, src, src_path, size, digest_algorithms)
+
+    if size <= self.part_size:
+      self.write_bytes(path, src.read_bytes(src_path))
+      return {}
+
+    object_key = self._object_key(path)
+    upload_id = self._create_multipart_upload(object_key)
+
+    def _copy_part(part_number: int) -> str:
+      offset = (part_number - 1) * self.part_size
+      data = src.read_range(src_path, offset, min(self.part_size, size - offset))
+      return self._upload_part(object_key, upload_id, part_number, data)
+
+    part_count = (size + self.part_size - 1) // self.part_size
+
+    try:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+        etags = list(executor.map(_copy_part, range(1, part_count + 1)))
+      self._complete_multipart_upload(object_key, upload_id, etags)
+    except BaseException:
+      self._abort_multipart_upload(object_key, upload_id)
+      raise
+
+    return {}
+
+class _ResponseReader(io.RawIOBase):
+  # streams the body of a response and releases its connection when closed
+
+  def __init__(self, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse):
+    super().__init__()
+    self._conn = conn
+    self._resp = resp
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, b) -> int:
+    return self._resp.readinto(b)
+
+  def close(self):
+    if not self.closed:
+      self._resp.close()
+      self._conn.close()
+    super().close()
+
+class _S3Writer(io.RawIOBase):
+  # buffers writes into parts that are uploaded in the background
+
+  def __init__(self, storage: S3Storage, path: str):
+    super().__init__()
+    self._storage = storage
+    self._object_key = storage._object_key(path) # pylint: disable=protected-access
+    self._buffer = bytearray()
+    self._upload_id: typing.Optional[str] = None
+    self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+    self._slots = threading.BoundedSemaphore(storage.concurrency)
+    self._parts: typing.List[concurrent.futures.Future] = []
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, b) -> int:
+    self._buffer.extend(b)
+    while len(self._buffer) >= self._storage.part_size:
+      data = bytes(self._buffer[:self._storage.part_size])
+      del self._buffer[:self._storage.part_size]
+      self._submit_part(data)
+    return len(b)
+
+  def _submit_part(self, data: bytes):
+    # pylint: disable=protected-access
+    if self._upload_id is None:
+      self._upload_id = self._storage._create_multipart_upload(self._object_key)
+      self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._storage.concurrency)
+
+    self._slots.acquire()
+    future = self._executor.submit(
+      self._storage._upload_part, self._object_key, self._upload_id, len(self._parts) + 1, data
+    )
+    future.add_done_callback(lambda _: self._slots.release())
+    self._parts.append(future)
+
+  def close(self):
+    # pylint: disable=protected-access
+    if self.closed:
+      return
+
+    try:
+      if self._upload_id is None:
+        self._storage._request("PUT", self._object_key, body=bytes(self._buffer))
+      else:
+        try:
+          if len(self._buffer) > 0:
+            self._submit_part(bytes(self._buffer))
+          etags = [f.result() for f in self._parts]
+          self._storage._complete_multipart_upload(self._object_key, self._upload_id, etags)
+        except BaseException:
+          self._storage._abort_multipart_upload(self._object_key, self._upload_id)
+          raise
+        finally:
+          self._executor.shutdown()
+    finally:
+      self._buffer = bytearray()
+      super().close()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    # a failed write discards the upload rather than completing it with partial content
+    if exc_type is not None:
+      self.abort()
+    else:
+      self.close()
+
+  def abort(self):
+    # pylint: disable=protected-access
+    if self.closed:
+      return
+
+    try:
+      if self._upload_id is not None:
+        self._executor.shutdown()
+        self._storage._abort_multipart_upload(self._object_key, self._upload_id)
+    finally:
+      self._buffer = bytearray()
+      super().close()
+
+class HTTPError(OSError):
+  pass
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+class HTTPStorage(Storage):
+  """Read-only Mapped File Set served over HTTP(S) at `url`. Requests share a pool of at most
+  `concurrency` keep-alive connections, and files are downloaded as up to `concurrency` parallel
+  `Range` requests of `part_size` bytes."""
+
+  def __init__(self, url: str, part_size: int = DEFAULT_PART_SIZE, concurrency: int = DEFAULT_CONCURRENCY):
+    if part_size <= 0:
+      raise ValueError("Part size must be positive")
+    if concurrency <= 0:
+      raise ValueError("Concurrency must be positive")
+
+    self.url = url.rstrip("/")
+    self.part_size = part_size
+    self.concurrency = concurrency
+
+    parsed_url = urllib.parse.urlsplit(self.url)
+    if parsed_url.scheme not in ("http", "https"):
+      raise ValueError(f"Unsupported URL: {url}")
+    self._path = parsed_url.path
+    self._pool = _ConnectionPool(parsed_url.scheme, parsed_url.netloc, concurrency)
+
+  @property
+  def key(self) -> typing.Hashable:
+    return ("http", self.url)
+
+  @property
+  def read_only(self) -> bool:
+    return True
+
+  def __str__(self) -> str:
+    return self.url
+
+  @property
+  def location(self) -> str:
+    return self.url
+
+  def _send(self, conn: http.client.HTTPConnection, method: str, path: str,
+            headers: typing.Optional[typing.Mapping[str, str]] = None) -> http.client.HTTPResponse:
+    uri = self._path + "/" + urllib.parse.quote(path)
+
+    conn.request(method, uri, headers=headers if headers is not None else {})
+    resp = conn.getresponse()
+
+    if resp.status >= 300:
+      resp.read()
+      raise HTTPError(f"{method} {self.url}/{path} failed with status {resp.status}")
+
+    return resp
+
+  def _request(self, method: str, path: str, **kwargs) -> typing.Tuple[http.client.HTTPResponse, bytes]:
+    return self._pool.request(lambda conn: self._send(conn, method, path, **kwargs))
+
+  def open(self, path: str) -> typing.BinaryIO:
+    return self._pool.stream(lambda conn: self._send(conn, "GET", path))
+
+  def read_bytes(self, path: str) -> bytes:
+    return self._request("GET", path)[1]
+
+  def _get_range(self, path: str, offset: int, length: int) -> typing.Tuple[bytes, typing.Optional[int]]:
+    # returns the bytes of the range and the size of the file, if known
+
+    resp, data = self._request("GET", path, headers={"Range": f"bytes={offset}-{offset + length - 1}"})
+
+    if resp.status == 206:
+      content_range = resp.getheader("Content-Range", "")
+      m = _CONTENT_RANGE_RE.fullmatch(content_range.strip())
+      if m is None or int(m.group(1)) != offset or int(m.group(2)) > offset + length - 1:
+        raise HTTPError(f"{self.url}/{path} returned range '{content_range}' instead of {offset}-{offset + length - 1}")
+      total = int(m.group(3)) if m.group(3) != "*" else None
+
+    # servers that ignore the Range header return the whole file
+    elif offset > 0:
+      raise HTTPError(f"{self.url}/{path} does not support range requests")
+
+    else:
+      total = len(data)
+
+    data = data[:length]
+    if len(data) != length:
+      raise HTTPError(f"{self.url}/{path} is shorter than expected")
+
+    return (data, total)
+
+  def read_range(self, path: str, offset: int, length: int) -> bytes:
+    return self._get_range(path, offset, length)[0]
+
+  def _read_part(self, path: str, offset: int, length: int, size: int) -> bytes:
+    # every part of a transfer must come from a file of the expected size, e.g. one that was not
+    # replaced while it was being downloaded
+
+    data, total = self._get_range(path, offset, length)
+
+    if total is not None and total != size:
+      raise HTTPError(f"{self.url}/{path} is {total} bytes but {size} bytes were expected")
+
+    return data
+
+  def size(self, path: str) -> int:
+    resp, _ = self._request("HEAD", path)
+    return int(resp.getheader("Content-Length"))
+
+  def _ranges(self, size: int) -> typing.Iterator[typing.Tuple[int, int]]:
+    for offset in range(0, size, self.part_size):
+      yield (offset, min(self.part_size, size - offset))
+
+  def iter_chunks(self, path: str, size: int) -> typing.Iterator[bytes]:
+    # parts are fetched in parallel and returned in order, with at most `concurrency` parts in memory
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+
+      try:
+        for offset, length in self._ranges(size):
+          if len(pending) == self.concurrency:
+            yield pending.popleft().result()
+          pending.append(executor.submit(self._read_part, path, offset, length, size))
+
+        while len(pending) > 0:
+          yield pending.popleft().result()
+      finally:
+        for f in pending:
+          f.cancel()
+
+  def download(self, path: str, dst_path: pathlib.Path, size: int):
+    """Downloads the file at `path`, which is `size` bytes long, to `dst_path`. Each part is written
+    at its offset as soon as it is received."""
+
+    if not hasattr(os, "pwrite"):
+      with dst_path.open("wb") as fp:
+        for chunk in self.iter_chunks(path, size):
+          fp.write(chunk)
+      return
+
+    fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+
+    def _fetch_part(offset: int, length: int):
+      data = self._read_part(path, offset, length, size)
+      view = memoryview(data)
+      while len(view) > 0:
+        view = view[os.pwrite(fd, view, offset + len(data) - len(view)):]
+
+    try:
+      os.ftruncate(fd, size)
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+        for f in [executor.submit(_fetch_part, offset, length) for offset, length in self._ranges(size)]:
+          f.result()
+    finally:
+      os.close(fd)
+
+  def close(self):
+    self._pool.close()
+
+def _http_storage(url: str, **s3_options) -> HTTPStorage:
+  # HTTP sources share the part size and concurrency of S3 transfers
+  return HTTPStorage(
+    url,
+    part_size=s3_options.get("part_size") or DEFAULT_PART_SIZE,
+    concurrency=s3_options.get("concurrency") or DEFAULT_CONCURRENCY
+  )
+
+def open_storage(location: typing.Union[str, pathlib.Path, Storage],
+                 durability: Durability = Durability.NONE,
+                 **s3_options) -> Storage:
+  """Returns the storage at `location`, which is either a local path, an `s3://bucket/prefix` URL or an
+  http(s) URL. `durability` applies to local paths and `s3_options` are passed to `S3Storage`."""
+
+  if isinstance(location, Storage):
+    return location
+
+  if isinstance(location, pathlib.Path):
+    return LocalStorage(location, durability)
+
+  url = urllib.parse.urlsplit(location)
+
+  if url.scheme == "s3":
+    return S3Storage(url.netloc, url.path, **s3_options)
+
+  if url.scheme in ("http", "https"):
+    return _http_storage(location, **s3_options)
+
+  return LocalStorage(pathlib.Path(location), durability)
+
+def open_file_location(location: typing.Union[str, pathlib.Path], **s3_options) -> typing.Tuple[Storage, str]:
+  """Splits the location of a file into the storage of its parent and the name of the file."""
+
+  if isinstance(location, pathlib.Path):
+    return (LocalStorage(location.parent.resolve()), location.name)
+
+  url = urllib.parse.urlsplit(location)
+
+  if url.scheme == "s3":
+    parent, _, name = url.path.strip("/").rpartition("/")
+    return (S3Storage(url.netloc, parent, **s3_options), name)
+
+  if url.scheme in ("http", "https"):
+    parent, _, name = location.rpartition("/")
+    return (_http_storage(parent, **s3_options), urllib.parse.unquote(name))
+
+  return open_file_location(pathlib.Path(location))
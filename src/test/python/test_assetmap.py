@@ -51,3 +51,19 @@ class AssetMapTest(unittest.TestCase):
     self.assertEqual(asset.id, "urn:uuid:d01bc6be-ae2f-436b-9705-c402e1d92212")
     self.assertFalse(asset.is_pkl)
     self.assertEqual(asset.path, "WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf")
+
+  def test_volumes(self):
+
+    am = assetmap.AssetMap(
+      assets=[assetmap.Asset("urn:uuid:d01bc6be-ae2f-436b-9705-c402e1d92212", "WAV.mxf", False, 2)],
+      volume_count=2
+    )
+
+    am = assetmap.AssetMap.from_element(am.to_element().getroot())
+
+    self.assertEqual(am.volume_count, 2)
+    self.assertEqual(am.assets[0].volume_index, 2)
+
+    vi = assetmap.VolumeIndex.from_element(assetmap.VolumeIndex(2).to_element().getroot())
+
+    self.assertEqual(vi.index, 2)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import shutil
+import pathlib
+import contextlib
+import io
+import xml.etree.ElementTree as ET
+
+import repkl.assetmap
+import repkl.catalog
+import repkl.storage
+import repkl.cli
+
+OV_CPL_ID = "urn:uuid:bb2ce11c-1bb6-4781-8e69-967183d02b9b"
+VF_CPL_ID = "urn:uuid:0b976350-bea1-4e62-ba07-f32b28aaaf30"
+VIDEO_ID = "urn:uuid:35e05073-878e-4b2f-b69d-2369f25adfc9"
+AUDIO_ID = "urn:uuid:d01bc6be-ae2f-436b-9705-c402e1d92212"
+
+class CatalogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.test_dir = pathlib.Path("build/catalog")
+    if self.test_dir.exists():
+      shutil.rmtree(self.test_dir)
+    self.test_dir.mkdir(parents=True)
+
+    self.catalog_path = self.test_dir.joinpath("catalog.sqlite")
+
+    self.deliveries = []
+    for name in ("countdown", "countdown-audio"):
+      shutil.copytree(f"src/test/resources/imp/{name}", self.test_dir.joinpath(name))
+      self.deliveries.append(repkl.storage.LocalStorage(self.test_dir.joinpath(name)))
+
+  def test_queries(self):
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update(self.deliveries)
+
+      self.assertEqual(catalog.cpls(), [VF_CPL_ID, OV_CPL_ID])
+      self.assertEqual(catalog.referenced_assets([OV_CPL_ID]), {VIDEO_ID})
+      self.assertEqual(catalog.referenced_assets([OV_CPL_ID, VF_CPL_ID]), {VIDEO_ID, AUDIO_ID})
+      self.assertEqual(catalog.referencing_cpls(VIDEO_ID), {OV_CPL_ID, VF_CPL_ID})
+      self.assertEqual(catalog.referencing_cpls(AUDIO_ID), {VF_CPL_ID})
+
+      # sizes are taken from the PackingLists
+
+      self.assertEqual(catalog.required_size([OV_CPL_ID]), 72224 + 8885)
+      self.assertEqual(catalog.required_size([OV_CPL_ID, VF_CPL_ID]), 72224 + 8885 + 305022 + 15830)
+
+      self.assertEqual(catalog.unreferenced_assets(), [])
+
+  def test_unreferenced(self):
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update(self.deliveries)
+
+    # the VF CPL is removed, leaving its audio track file unreferenced
+
+    self.deliveries[1].path("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml").unlink()
+    am_path = self.deliveries[1].path("ASSETMAP.xml")
+    am = repkl.assetmap.AssetMap.from_element(ET.parse(am_path).getroot())
+    am.assets = [a for a in am.assets if a.id != VF_CPL_ID]
+    am.write(am_path)
+
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update([], refresh=True)
+
+      self.assertEqual(catalog.referencing_cpls(AUDIO_ID), set())
+
+      unreferenced = catalog.unreferenced_assets()
+      self.assertEqual(len(unreferenced), 1)
+      self.assertEqual(unreferenced[0].id, AUDIO_ID)
+      self.assertEqual(unreferenced[0].root, self.deliveries[1].location)
+      self.assertEqual(unreferenced[0].size, 305022)
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      repkl.cli.catalog_main([str(self.catalog_path), "unreferenced"])
+
+    self.assertIn("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf", out.getvalue())
+
+  def test_unreadable_cpl(self):
+
+    # the OV CPL is truncated, so that the assets it references are unknown
+
+    cpl_path = self.deliveries[0].path("CPL_bb2ce11c-1bb6-4781-8e69-967183d02b9b.xml")
+    cpl_data = cpl_path.read_bytes()
+    cpl_path.write_bytes(cpl_data[:len(cpl_data) // 2])
+
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update([self.deliveries[0]])
+
+      self.assertEqual(catalog.incomplete_roots, [self.deliveries[0].location])
+
+      with self.assertRaises(ValueError):
+        catalog.unreferenced_assets()
+
+    with self.assertRaises(ValueError):
+      repkl.cli.catalog_main([str(self.catalog_path), "unreferenced"])
+
+    # the Mapped File Set is scanned again once the CPL can be read, although its AssetMap is unchanged
+
+    cpl_path.write_bytes(cpl_data)
+
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update([], refresh=True)
+
+      self.assertEqual(catalog.incomplete_roots, [])
+      self.assertEqual(catalog.unreferenced_assets(), [])
+
+  def test_refresh_removes_deleted(self):
+    with repkl.catalog.Catalog(self.catalog_path) as catalog:
+      catalog.update(self.deliveries)
+
+      shutil.rmtree(self.deliveries[1].root)
+      catalog.update([], refresh=True)
+
+      self.assertEqual(catalog.roots, [self.deliveries[0].location])
+      self.assertEqual(catalog.referencing_cpls(VIDEO_ID), {OV_CPL_ID})
@@ -24,10 +24,17 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import unittest
+import unittest.mock
 import shutil
 import pathlib
+import tarfile
+import xml.etree.ElementTree as ET
 
 import repkl.cli
+import repkl.storage
+import repkl.assetmap
+import repkl.pkl
+import repkl.digest
 
 class CLITest(unittest.TestCase):
 
@@ -125,3 +132,506 @@ class CLITest(unittest.TestCase):
       str(SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
       str(TEST_DIR)
     ])
+
+  def test_tar(self):
+
+    TEST_DIR = pathlib.Path("build/tar-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    tar_path = TEST_DIR.joinpath("vf.tar")
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--output-format",
+      "tar",
+      "--ov",
+      "src/test/resources/imp/countdown/CPL_bb2ce11c-1bb6-4781-8e69-967183d02b9b.xml",
+      "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(tar_path)
+    ])
+
+    with tarfile.open(tar_path) as tar:
+      names = tar.getnames()
+      self.assertIn("ASSETMAP.xml", names)
+      self.assertIn("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml", names)
+      self.assertEqual(
+        tar.extractfile("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").read(),
+        pathlib.Path("src/test/resources/imp/countdown-audio/WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").read_bytes()
+      )
+
+  def test_tar_aborted_on_failure(self):
+
+    TEST_DIR = pathlib.Path("build/tar-failure-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    tar_path = TEST_DIR.joinpath("vf.tar")
+
+    # the source fails after part of the first asset has been written
+
+    iter_chunks = repkl.storage.Storage.iter_chunks
+
+    def _failing_iter_chunks(storage, path, size):
+      for chunk in iter_chunks(storage, path, size):
+        yield chunk[:1024]
+        raise OSError(f"{path} cannot be read")
+
+    with unittest.mock.patch.object(repkl.storage.Storage, "iter_chunks", _failing_iter_chunks):
+      with self.assertRaises(OSError):
+        repkl.cli.main([
+          "--action",
+          "copy",
+          "--output-format",
+          "tar",
+          "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+          str(tar_path)
+        ])
+
+    # the archive is left truncated so that the partial member cannot be extracted
+
+    self.assertGreater(tar_path.stat().st_size, tarfile.BLOCKSIZE)
+
+    with self.assertRaises(tarfile.ReadError):
+      with tarfile.open(tar_path) as tar:
+        tar.getmembers()
+
+  def test_duplicate_deliveries(self):
+
+    SRC_DIRS = [pathlib.Path("build/dup-src-imp-1"), pathlib.Path("build/dup-src-imp-2")]
+
+    for p in SRC_DIRS:
+      if p.exists():
+        shutil.rmtree(p)
+      shutil.copytree("src/test/resources/imp/countdown-audio", p)
+
+    # the first copy of the track file is missing and must not be selected
+
+    SRC_DIRS[0].joinpath("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").unlink()
+
+    TEST_DIR = pathlib.Path("build/dup-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--delivery",
+      str(SRC_DIRS[0]),
+      "--delivery",
+      str(SRC_DIRS[1]),
+      "--fast-device",
+      str(SRC_DIRS[0]),
+      str(SRC_DIRS[0].joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+      str(TEST_DIR)
+    ])
+
+    self.assertTrue(TEST_DIR.joinpath("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").is_file())
+
+  def test_conflicting_deliveries(self):
+
+    SRC_DIRS = [pathlib.Path("build/conflict-src-imp-1"), pathlib.Path("build/conflict-src-imp-2")]
+
+    for p in SRC_DIRS:
+      if p.exists():
+        shutil.rmtree(p)
+      shutil.copytree("src/test/resources/imp/countdown-audio", p)
+
+    pkl_path = SRC_DIRS[1].joinpath("PKL_e8aa8652-f9de-4d8d-b337-53123066605e.xml")
+    pkl_path.write_text(pkl_path.read_text().replace("<Size>305022</Size>", "<Size>305023</Size>"))
+
+    TEST_DIR = pathlib.Path("build/conflict-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "--delivery",
+        str(SRC_DIRS[0]),
+        "--delivery",
+        str(SRC_DIRS[1]),
+        str(SRC_DIRS[0].joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+        str(TEST_DIR)
+      ])
+
+  def test_size_mismatch(self):
+
+    SRC_DIR = pathlib.Path("build/size-src-imp")
+
+    if SRC_DIR.exists():
+      shutil.rmtree(SRC_DIR)
+    shutil.copytree("src/test/resources/imp/countdown-audio", SRC_DIR)
+
+    # the track file is truncated
+
+    asset_path = SRC_DIR.joinpath("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf")
+    asset_path.write_bytes(asset_path.read_bytes()[:-1])
+
+    TEST_DIR = pathlib.Path("build/size-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        str(SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+        str(TEST_DIR)
+      ])
+
+    self.assertFalse(TEST_DIR.joinpath("ASSETMAP.xml").exists())
+
+    # the mismatch is tolerated on request
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--allow-size-mismatch",
+      str(SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+      str(TEST_DIR)
+    ])
+
+    self.assertTrue(TEST_DIR.joinpath("ASSETMAP.xml").exists())
+
+  def test_verify(self):
+
+    SRC_DIR = pathlib.Path("build/verify-src-imp")
+
+    if SRC_DIR.exists():
+      shutil.rmtree(SRC_DIR)
+    shutil.copytree("src/test/resources/imp/countdown-audio", SRC_DIR)
+
+    cpl_path = SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")
+
+    TEST_DIR = pathlib.Path("build/verify-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--verify",
+      "--digest-cache",
+      str(TEST_DIR.parent.joinpath("verify-digests.sqlite")),
+      str(cpl_path),
+      str(TEST_DIR)
+    ])
+
+    # assets whose size differs from the PackingList are detected
+
+    pkl_path = SRC_DIR.joinpath("PKL_e8aa8652-f9de-4d8d-b337-53123066605e.xml")
+    pkl_data = pkl_path.read_text()
+    pkl_path.write_text(pkl_data.replace("<Size>305022</Size>", "<Size>305023</Size>"))
+
+    self._prep_dir(TEST_DIR)
+
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "--verify",
+        str(cpl_path),
+        str(TEST_DIR)
+      ])
+
+    pkl_path.write_text(pkl_data)
+
+    # corrupted assets are detected
+
+    asset_path = SRC_DIR.joinpath("countdown-small.mxf")
+    asset_path.write_bytes(asset_path.read_bytes()[::-1])
+
+    self._prep_dir(TEST_DIR)
+
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "--verify",
+        "--digest-cache",
+        str(TEST_DIR.parent.joinpath("verify-digests.sqlite")),
+        str(cpl_path),
+        str(TEST_DIR)
+      ])
+
+  def test_index(self):
+
+    INDEX_PATH = pathlib.Path("build/cli-assets.idx")
+
+    repkl.cli.index_main([
+      "build",
+      str(INDEX_PATH),
+      "src/test/resources/imp/countdown",
+      "src/test/resources/imp/countdown-audio"
+    ])
+
+    TEST_DIR = pathlib.Path("build/index-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--index",
+      str(INDEX_PATH),
+      "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(TEST_DIR)
+    ])
+
+    self.assertTrue(TEST_DIR.joinpath("countdown-small.mxf").is_file())
+
+  def test_multi_volume(self):
+
+    VOLUME_DIRS = [pathlib.Path("build/volume-imp-1"), pathlib.Path("build/volume-imp-2")]
+
+    for p in VOLUME_DIRS:
+      self._prep_dir(p)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--volume",
+      str(VOLUME_DIRS[1]),
+      "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(VOLUME_DIRS[0])
+    ])
+
+    # the largest asset is alone on its volume, with the PackingList
+
+    self.assertEqual(
+      {p.name for p in VOLUME_DIRS[0].iterdir() if not p.name.startswith("PKL_")},
+      {"ASSETMAP.xml", "VOLINDEX.xml", "WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf"}
+    )
+    self.assertEqual(
+      {p.name for p in VOLUME_DIRS[1].iterdir()},
+      {"ASSETMAP.xml", "VOLINDEX.xml", "CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml", "countdown-small.mxf"}
+    )
+
+    # the new Mapped File Set can be read back from its volumes
+
+    TEST_DIR = pathlib.Path("build/volume-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--delivery",
+      str(VOLUME_DIRS[0]),
+      "--delivery",
+      str(VOLUME_DIRS[1]),
+      str(VOLUME_DIRS[1].joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+      str(TEST_DIR)
+    ])
+
+    self.assertTrue(TEST_DIR.joinpath("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").is_file())
+
+  def test_fan_out(self):
+
+    SRC_DIR = pathlib.Path("build/fan-out-src-imp")
+
+    if SRC_DIR.exists():
+      shutil.rmtree(SRC_DIR)
+    shutil.copytree("src/test/resources/imp/countdown-audio", SRC_DIR)
+
+    cpl_path = SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")
+
+    TEST_DIRS = [pathlib.Path("build/fan-out-imp-1"), pathlib.Path("build/fan-out-imp-2")]
+
+    for e in TEST_DIRS:
+      self._prep_dir(e)
+
+    cache_path = pathlib.Path("build/fan-out-digests.sqlite")
+    if cache_path.exists():
+      cache_path.unlink()
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--verify",
+      "--digest-cache",
+      str(cache_path),
+      str(cpl_path),
+      *map(str, TEST_DIRS)
+    ])
+
+    self.assertEqual(
+      sorted(e.name for e in TEST_DIRS[0].iterdir()),
+      sorted(e.name for e in TEST_DIRS[1].iterdir())
+    )
+
+    for e in TEST_DIRS[0].iterdir():
+      self.assertEqual(e.read_bytes(), TEST_DIRS[1].joinpath(e.name).read_bytes())
+
+    self.assertEqual(
+      TEST_DIRS[1].joinpath("countdown-small.mxf").read_bytes(),
+      SRC_DIR.joinpath("countdown-small.mxf").read_bytes()
+    )
+
+    # multiple destinations cannot be combined with moves
+
+    for e in TEST_DIRS:
+      self._prep_dir(e)
+
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "move",
+        str(cpl_path),
+        *map(str, TEST_DIRS)
+      ])
+
+  def test_durability(self):
+
+    for durability in ("batch", "per-file"):
+      TEST_DIR = pathlib.Path(f"build/durability-{durability}-imp")
+
+      self._prep_dir(TEST_DIR)
+
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "--durability",
+        durability,
+        "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+        str(TEST_DIR)
+      ])
+
+      self.assertTrue(TEST_DIR.joinpath("ASSETMAP.xml").exists())
+      self.assertFalse(any(p.name.endswith(".tmp") for p in TEST_DIR.iterdir()))
+
+    # the assets are synced before the manifests are written
+
+    TEST_DIR = pathlib.Path("build/durability-order-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    events = []
+    sync = repkl.storage.LocalStorage.sync
+    write_bytes = repkl.storage.LocalStorage.write_bytes
+
+    def _sync(storage):
+      events.append("sync")
+      sync(storage)
+
+    def _write_bytes(storage, path, data):
+      events.append(path)
+      write_bytes(storage, path, data)
+
+    with unittest.mock.patch.object(repkl.storage.LocalStorage, "sync", _sync), \
+      unittest.mock.patch.object(repkl.storage.LocalStorage, "write_bytes", _write_bytes):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "--durability",
+        "batch",
+        "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+        str(TEST_DIR)
+      ])
+
+    self.assertEqual(events[0], "sync")
+    self.assertTrue(events[1].startswith("PKL_"))
+    self.assertEqual(events[2], "ASSETMAP.xml")
+
+  def test_hash_algorithm(self):
+
+    # the source is copied without its cached digests so that they are computed
+
+    SRC_DIR = pathlib.Path("build/sha256-src-imp")
+
+    if SRC_DIR.exists():
+      shutil.rmtree(SRC_DIR)
+    shutil.copytree("src/test/resources/imp/countdown-audio", SRC_DIR, copy_function=shutil.copyfile)
+
+    for action in ("symlink", "copy"):
+      TEST_DIR = pathlib.Path(f"build/sha256-{action}-imp")
+
+      self._prep_dir(TEST_DIR)
+
+      repkl.cli.main([
+        "--action",
+        action,
+        "--hash-algorithm",
+        "sha256",
+        "--digest-cache",
+        str(TEST_DIR.parent.joinpath(f"sha256-{action}-digests.sqlite")),
+        str(SRC_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+        str(TEST_DIR)
+      ])
+
+      am = repkl.assetmap.AssetMap.from_element(ET.parse(str(TEST_DIR.joinpath("ASSETMAP.xml"))).getroot())
+      pkl_path = next(a.path for a in am.assets if a.is_pkl)
+      pkl = repkl.pkl.PackingList.from_element(ET.parse(str(TEST_DIR.joinpath(pkl_path))).getroot())
+
+      paths = {a.id: a.path for a in am.assets}
+
+      for asset in pkl.assets:
+        self.assertEqual(asset.hash_algorithm, repkl.digest.SHA256_URI)
+        self.assertEqual(
+          asset.hash,
+          repkl.digest.compute_digest(TEST_DIR.joinpath(paths[asset.id]), repkl.digest.SHA256_URI)
+        )
+
+  def test_append(self):
+
+    TEST_DIR = pathlib.Path("build/append-imp")
+
+    self._prep_dir(TEST_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "src/test/resources/imp/countdown/CPL_bb2ce11c-1bb6-4781-8e69-967183d02b9b.xml",
+      str(TEST_DIR)
+    ])
+
+    video_stat = TEST_DIR.joinpath("countdown-small.mxf").stat()
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--append",
+      "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(TEST_DIR)
+    ])
+
+    # assets already present are not transferred again
+
+    self.assertEqual(TEST_DIR.joinpath("countdown-small.mxf").stat().st_ino, video_stat.st_ino)
+    self.assertEqual(TEST_DIR.joinpath("countdown-small.mxf").stat().st_mtime_ns, video_stat.st_mtime_ns)
+
+    am = repkl.assetmap.AssetMap.from_element(ET.parse(str(TEST_DIR.joinpath("ASSETMAP.xml"))).getroot())
+
+    self.assertEqual(len([a for a in am.assets if a.is_pkl]), 2)
+    self.assertEqual(
+      {a.path for a in am.assets if not a.is_pkl},
+      {
+        "countdown-small.mxf",
+        "CPL_bb2ce11c-1bb6-4781-8e69-967183d02b9b.xml",
+        "CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+        "WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf"
+      }
+    )
+
+    for a in am.assets:
+      self.assertTrue(TEST_DIR.joinpath(a.path).exists())
+
+    # the appended CPL can be extracted from the destination
+
+    EXTRACT_DIR = pathlib.Path("build/append-extract-imp")
+
+    self._prep_dir(EXTRACT_DIR)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      str(TEST_DIR.joinpath("CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")),
+      str(EXTRACT_DIR)
+    ])
+
+    self.assertTrue(EXTRACT_DIR.joinpath("WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf").exists())
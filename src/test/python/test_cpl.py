@@ -25,9 +25,13 @@
 
 
 import unittest
+import unittest.mock
+import io
+import pathlib
 import xml.etree.ElementTree as ET
 
 import repkl.cpl
+import repkl.storage
 
 class CPLTest(unittest.TestCase):
 
@@ -43,3 +47,38 @@ class CPLTest(unittest.TestCase):
 
     self.assertIn("urn:uuid:35e05073-878e-4b2f-b69d-2369f25adfc9", resource_ids)
     self.assertIn("urn:uuid:d01bc6be-ae2f-436b-9705-c402e1d92212", resource_ids)
+
+  def test_from_stream(self):
+
+    path = pathlib.Path("src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")
+
+    with path.open("rb") as fp:
+      composition = repkl.cpl.Composition.from_stream(fp)
+
+    self.assertEqual(composition, repkl.cpl.Composition.from_element(ET.parse(str(path)).getroot()))
+
+    with path.parent.joinpath("ASSETMAP.xml").open("rb") as fp:
+      with self.assertRaises(repkl.cpl.NotACompositionError):
+        repkl.cpl.Composition.from_stream(fp)
+
+    # documents without a namespace, e.g. text/xml sidecar files, are not CPLs
+
+    with self.assertRaises(repkl.cpl.NotACompositionError):
+      repkl.cpl.Composition.from_stream(io.BytesIO(b"<CompositionPlaylist><Id>sidecar</Id></CompositionPlaylist>"))
+
+  def test_load_composition(self):
+
+    storage = repkl.storage.LocalStorage(pathlib.Path("src/test/resources/imp/countdown-audio"))
+
+    repkl.cpl._composition_cache.clear() # pylint: disable=protected-access
+
+    with unittest.mock.patch.object(
+      repkl.cpl.Composition,
+      "from_stream",
+      wraps=repkl.cpl.Composition.from_stream
+    ) as from_stream:
+      repkl.cpl.load_composition(storage, "CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")
+      composition = repkl.cpl.load_composition(storage, "CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml")
+
+    self.assertEqual(from_stream.call_count, 1)
+    self.assertEqual(composition.id, "urn:uuid:0b976350-bea1-4e62-ba07-f32b28aaaf30")
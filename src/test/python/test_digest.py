@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import unittest.mock
+import os
+import shutil
+import pathlib
+
+import repkl.digest
+
+ASSET_PATH = pathlib.Path("src/test/resources/imp/countdown-audio/WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf")
+ASSET_SHA1 = "RB2PQUbbil0rRRTrsvQRj1M7uE0="
+
+class DigestCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.test_dir = pathlib.Path("build/digest-cache")
+    if self.test_dir.exists():
+      shutil.rmtree(self.test_dir)
+    self.test_dir.mkdir(parents=True)
+
+    self.asset_path = self.test_dir.joinpath(ASSET_PATH.name)
+    shutil.copyfile(ASSET_PATH, self.asset_path)
+
+  def _check_cache(self, cache: repkl.digest.DigestCache):
+    self.assertIsNone(cache.get(self.asset_path, repkl.digest.SHA1_URI))
+
+    self.assertEqual(cache.digest(self.asset_path, repkl.digest.SHA1_URI), ASSET_SHA1)
+
+    with unittest.mock.patch("repkl.digest.compute_digest") as compute_digest:
+      self.assertEqual(cache.digest(self.asset_path, repkl.digest.SHA1_URI), ASSET_SHA1)
+      compute_digest.assert_not_called()
+
+    # hard links share the cached digest
+
+    link_path = self.test_dir.joinpath("link.mxf")
+    os.link(self.asset_path, link_path)
+    self.assertEqual(cache.get(link_path, repkl.digest.SHA1_URI), ASSET_SHA1)
+
+    # copies inherit the cached digest
+
+    copy_path = self.test_dir.joinpath("copy.mxf")
+    shutil.copyfile(self.asset_path, copy_path)
+    self.assertIsNone(cache.get(copy_path, repkl.digest.SHA1_URI))
+    cache.copy(self.asset_path, copy_path)
+    self.assertEqual(cache.get(copy_path, repkl.digest.SHA1_URI), ASSET_SHA1)
+
+    # the cached digest is invalidated by modifications
+
+    st = os.stat(self.asset_path)
+    os.utime(self.asset_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    self.assertIsNone(cache.get(self.asset_path, repkl.digest.SHA1_URI))
+
+  def test_xattrs(self):
+    try:
+      os.setxattr(self.asset_path, "user.repkl.test", b"")
+    except (AttributeError, OSError) as e:
+      raise unittest.SkipTest("Extended attributes are not supported") from e
+
+    cache = repkl.digest.DigestCache(self.test_dir.joinpath("digests.sqlite"))
+    self._check_cache(cache)
+    cache.close()
+
+    self.assertFalse(self.test_dir.joinpath("digests.sqlite").exists())
+
+  def test_sidecar(self):
+    cache = repkl.digest.DigestCache(self.test_dir.joinpath("digests.sqlite"), use_xattrs=False)
+    self._check_cache(cache)
+    cache.close()
+
+    self.assertTrue(self.test_dir.joinpath("digests.sqlite").exists())
+
+  def test_compute_digest(self):
+    self.assertEqual(repkl.digest.compute_digest(ASSET_PATH, repkl.digest.SHA1_URI), ASSET_SHA1)
+
+    with self.assertRaises(ValueError):
+      repkl.digest.compute_digest(ASSET_PATH, "urn:unknown")
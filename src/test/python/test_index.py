@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import unittest.mock
+import shutil
+import pathlib
+import xml.etree.ElementTree as ET
+
+import repkl.index
+import repkl.pkl
+import repkl.storage
+
+class AssetIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.test_dir = pathlib.Path("build/index")
+    if self.test_dir.exists():
+      shutil.rmtree(self.test_dir)
+    self.test_dir.mkdir(parents=True)
+
+    self.index_path = self.test_dir.joinpath("assets.idx")
+
+    self.deliveries = []
+    for name in ("countdown", "countdown-audio"):
+      shutil.copytree(f"src/test/resources/imp/{name}", self.test_dir.joinpath(name))
+      self.deliveries.append(repkl.storage.LocalStorage(self.test_dir.joinpath(name)))
+
+  def test_build_lookup(self):
+    repkl.index.build_index(self.index_path, self.deliveries)
+
+    with repkl.index.AssetIndex(self.index_path) as index:
+      self.assertEqual(len(index), 7)
+      self.assertEqual(set(index.roots), {d.location for d in self.deliveries})
+
+      # the OV track file is present in both deliveries
+
+      records = index.lookup("urn:uuid:35e05073-878e-4b2f-b69d-2369f25adfc9")
+      self.assertEqual(len(records), 2)
+      self.assertEqual({r.root for r in records}, {d.location for d in self.deliveries})
+
+      records = index.lookup("urn:uuid:d01bc6be-ae2f-436b-9705-c402e1d92212")
+      self.assertEqual(len(records), 1)
+      self.assertEqual(records[0].am_asset.path, "WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf")
+      self.assertFalse(records[0].am_asset.is_pkl)
+
+      pkl = repkl.pkl.PackingList.from_element(
+        ET.parse(self.test_dir.joinpath("countdown-audio", "PKL_e8aa8652-f9de-4d8d-b337-53123066605e.xml")).getroot()
+      )
+      self.assertEqual(records[0].pkl_asset, next(a for a in pkl.assets if a.id == records[0].am_asset.id))
+
+      records = index.lookup("urn:uuid:e8aa8652-f9de-4d8d-b337-53123066605e")
+      self.assertEqual(len(records), 1)
+      self.assertTrue(records[0].am_asset.is_pkl)
+      self.assertIsNone(records[0].pkl_asset)
+
+      self.assertEqual(index.lookup("urn:uuid:00000000-0000-0000-0000-000000000000"), [])
+      self.assertEqual(index.lookup("not-a-uuid"), [])
+
+  def test_refresh(self):
+    repkl.index.build_index(self.index_path, self.deliveries[:1])
+
+    with unittest.mock.patch("repkl.index.scan_mapped_file_set", wraps=repkl.index.scan_mapped_file_set) as scan:
+      repkl.index.build_index(self.index_path, self.deliveries[1:], refresh=True)
+      scan.assert_called_once()
+      self.assertEqual(scan.call_args[0][0], self.deliveries[1])
+
+    with repkl.index.AssetIndex(self.index_path) as index:
+      self.assertEqual(len(index), 7)
+
+    # deleted Mapped File Sets are dropped
+
+    shutil.rmtree(self.deliveries[1].root)
+
+    repkl.index.build_index(self.index_path, [], refresh=True)
+
+    with repkl.index.AssetIndex(self.index_path) as index:
+      self.assertEqual(index.roots, [self.deliveries[0].location])
+      self.assertEqual(len(index), 3)
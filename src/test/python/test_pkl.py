@@ -52,3 +52,19 @@ class PKLTest(unittest.TestCase):
     self.assertEqual(asset.hash_algorithm, "http://www.w3.org/2000/09/xmldsig#sha1")
     self.assertIsNone(asset.annotation_text)
     self.assertIsNone(asset.annotation_text_lang)
+
+  def test_asset_round_trip(self):
+
+    asset = repkl.pkl.Asset(
+      id="urn:uuid:0b976350-bea1-4e62-ba07-f32b28aaaf30",
+      annotation_text="CPL",
+      annotation_text_lang="en",
+      hash="vE6fVvdzUVC6+YE/tM/vyY8qJ2Y=",
+      size=15830,
+      type="text/xml",
+      original_filename=None,
+      original_filename_lang=None,
+      hash_algorithm="http://www.w3.org/2001/04/xmlenc#sha256"
+    )
+
+    self.assertEqual(repkl.pkl.Asset.from_element(asset.to_element()), asset)
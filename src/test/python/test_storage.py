@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Copyright (c) 2022, Sandflow Consulting LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import unittest.mock
+import os
+import stat
+import shutil
+import pathlib
+import threading
+import uuid
+import urllib.parse
+import http.server
+import xml.etree.ElementTree as ET
+
+import repkl.storage
+import repkl.cli
+
+class LocalStorageTest(unittest.TestCase):
+
+  def setUp(self):
+    self.test_dir = pathlib.Path("build/local-storage")
+    if self.test_dir.exists():
+      shutil.rmtree(self.test_dir)
+    self.test_dir.mkdir(parents=True)
+
+  def test_atomic_write(self):
+    storage = repkl.storage.LocalStorage(self.test_dir)
+    storage.write_bytes("ASSETMAP.xml", b"old")
+    storage.write_bytes("ASSETMAP.xml", b"new")
+    storage.close()
+
+    self.assertEqual([p.name for p in self.test_dir.iterdir()], ["ASSETMAP.xml"])
+    self.assertEqual(self.test_dir.joinpath("ASSETMAP.xml").read_bytes(), b"new")
+
+  @unittest.skipIf(os.name != "posix", "POSIX file modes")
+  def test_atomic_write_mode(self):
+    storage = repkl.storage.LocalStorage(self.test_dir)
+
+    # new files get the mode of files created under the umask
+
+    umask = os.umask(0o022)
+    try:
+      storage.write_bytes("ASSETMAP.xml", b"old")
+    finally:
+      os.umask(umask)
+    self.assertEqual(stat.S_IMODE(self.test_dir.joinpath("ASSETMAP.xml").stat().st_mode), 0o644)
+
+    # replaced files keep their mode
+
+    self.test_dir.joinpath("ASSETMAP.xml").chmod(0o664)
+    storage.write_bytes("ASSETMAP.xml", b"new")
+    self.assertEqual(stat.S_IMODE(self.test_dir.joinpath("ASSETMAP.xml").stat().st_mode), 0o664)
+
+  def test_batch_durability(self):
+    src = repkl.storage.LocalStorage(pathlib.Path("src/test/resources/imp/countdown-audio"))
+    storage = repkl.storage.LocalStorage(self.test_dir, repkl.storage.Durability.BATCH)
+
+    with unittest.mock.patch("repkl.storage._syncfs", return_value=False) as syncfs, \
+      unittest.mock.patch("os.fsync", wraps=os.fsync) as fsync:
+      storage.put_file("countdown-small.mxf", src, "countdown-small.mxf", src.size("countdown-small.mxf"))
+      with storage.open_write("a.bin", 3) as fp:
+        fp.write(b"abc")
+
+      # files are synced only when the storage is closed
+
+      self.assertEqual(fsync.call_count, 0)
+      storage.close()
+      syncfs.assert_called_once_with(self.test_dir)
+
+      # two files and the directory
+      self.assertEqual(fsync.call_count, 3)
+
+  def test_per_file_durability(self):
+    storage = repkl.storage.LocalStorage(self.test_dir, repkl.storage.Durability.PER_FILE)
+
+    with unittest.mock.patch("os.fsync", wraps=os.fsync) as fsync:
+      with storage.open_write("a.bin", 3) as fp:
+        fp.write(b"abc")
+      self.assertEqual(fsync.call_count, 1)
+
+      # the manifest and its directory
+      storage.write_bytes("ASSETMAP.xml", b"abc")
+      self.assertEqual(fsync.call_count, 3)
+
+    self.assertEqual(self.test_dir.joinpath("a.bin").read_bytes(), b"abc")
+
+class _StandInS3Handler(http.server.BaseHTTPRequestHandler):
+  # minimal path-style S3 API: objects, multipart uploads and ListObjectsV2
+
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args): # pylint: disable=redefined-builtin
+    pass
+
+  def _parse(self):
+    url = urllib.parse.urlsplit(self.path)
+    query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+    bucket, _, key = urllib.parse.unquote(url.path).lstrip("/").partition("/")
+    return bucket, key, query
+
+  def _body(self) -> bytes:
+    return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+  def _reply(self, status: int, body: bytes = b"", headers=None):
+    self.send_response(status)
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    if self.command != "HEAD":
+      self.wfile.write(body)
+
+  def do_PUT(self):
+    self.server.requests.append(("PUT", self.path))
+    if "Authorization" not in self.headers:
+      self._reply(403)
+      return
+    bucket, key, query = self._parse()
+    data = self._body()
+    if "uploadId" in query:
+      self.server.uploads[query["uploadId"]][int(query["partNumber"])] = data
+    else:
+      self.server.objects[(bucket, key)] = data
+    self._reply(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+  def do_POST(self):
+    bucket, key, query = self._parse()
+    body = self._body()
+    if "uploads" in query:
+      upload_id = uuid.uuid4().hex
+      self.server.uploads[upload_id] = {}
+      self._reply(200, (
+        '<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+        "</InitiateMultipartUploadResult>").encode())
+    else:
+      parts = self.server.uploads.pop(query["uploadId"])
+      numbers = [int(e.text) for e in ET.fromstring(body).iter("PartNumber")]
+      self.server.objects[(bucket, key)] = b"".join(parts[n] for n in numbers)
+      self.server.completed.append(len(numbers))
+      self._reply(200, b"<CompleteMultipartUploadResult/>")
+
+  def do_DELETE(self):
+    _, _, query = self._parse()
+    if self.server.fail_deletes:
+      self._reply(500)
+      return
+    self.server.uploads.pop(query.get("uploadId"), None)
+    self._reply(204)
+
+  def do_HEAD(self):
+    bucket, key, _ = self._parse()
+    data = self.server.objects.get((bucket, key))
+    if data is None:
+      self._reply(404)
+    else:
+      self.send_response(200)
+      self.send_header("Content-Length", str(len(data)))
+      self.end_headers()
+
+  def do_GET(self):
+    bucket, key, query = self._parse()
+
+    if query.get("list-type") == "2":
+      prefix = query.get("prefix", "")
+      keys = sorted(k for b, k in self.server.objects if b == bucket and k.startswith(prefix))
+      contents = "".join(f"<Contents><Key>{k}</Key></Contents>" for k in keys)
+      self._reply(200, (
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<KeyCount>{len(keys)}</KeyCount>{contents}</ListBucketResult>").encode())
+      return
+
+    data = self.server.objects.get((bucket, key))
+    if data is None:
+      self._reply(404)
+      return
+
+    byte_range = self.headers.get("Range")
+    if byte_range is not None:
+      first, _, last = byte_range[len("bytes="):].partition("-")
+      self._reply(206, data[int(first):int(last) + 1])
+    else:
+      self._reply(200, data)
+
+class StandInS3Server(http.server.ThreadingHTTPServer):
+
+  def __init__(self):
+    super().__init__(("127.0.0.1", 0), _StandInS3Handler)
+    self.objects = {}
+    self.uploads = {}
+    self.completed = []
+    self.requests = []
+    self.connections = 0
+    self.fail_deletes = False
+
+  def process_request(self, request, client_address):
+    self.connections += 1
+    super().process_request(request, client_address)
+
+  @property
+  def endpoint(self) -> str:
+    return f"http://127.0.0.1:{self.server_address[1]}"
+
+class S3StorageTest(unittest.TestCase):
+
+  def setUp(self):
+    env = unittest.mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "key", "AWS_SECRET_ACCESS_KEY": "secret"})
+    env.start()
+    self.addCleanup(env.stop)
+
+    # parts smaller than the S3 minimum keep the test uploads small
+    min_part_size = unittest.mock.patch("repkl.storage.MIN_PART_SIZE", 1)
+    min_part_size.start()
+    self.addCleanup(min_part_size.stop)
+
+    self.server = StandInS3Server()
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _storage(self, **kwargs) -> repkl.storage.S3Storage:
+    s3 = repkl.storage.S3Storage(
+      "bucket",
+      "delivery",
+      endpoint=self.server.endpoint,
+      access_key="key",
+      secret_key="secret",
+      **kwargs
+    )
+    self.addCleanup(s3.close)
+    return s3
+
+  def test_write_read(self):
+    s3 = self._storage()
+
+    self.assertTrue(s3.is_empty())
+
+    s3.write_bytes("ASSETMAP.xml", b"<AssetMap/>")
+
+    self.assertFalse(s3.is_empty())
+    self.assertEqual(self.server.objects[("bucket", "delivery/ASSETMAP.xml")], b"<AssetMap/>")
+    self.assertEqual(s3.read_bytes("ASSETMAP.xml"), b"<AssetMap/>")
+    self.assertEqual(s3.read_range("ASSETMAP.xml", 1, 8), b"AssetMap")
+    self.assertEqual(s3.size("ASSETMAP.xml"), 11)
+
+  def test_multipart_put_file(self):
+    src = repkl.storage.LocalStorage(pathlib.Path("src/test/resources/imp/countdown"))
+    size = src.size("countdown-small.mxf")
+
+    s3 = self._storage(part_size=64 * 1024, concurrency=3)
+    s3.put_file("countdown-small.mxf", src, "countdown-small.mxf", size)
+
+    self.assertEqual(self.server.completed, [(size + 64 * 1024 - 1) // (64 * 1024)])
+    self.assertEqual(self.server.objects[("bucket", "delivery/countdown-small.mxf")], src.read_bytes("countdown-small.mxf"))
+
+  def test_part_size(self):
+    with self.assertRaises(ValueError):
+      self._storage(part_size=64 * 1024, min_part_size=repkl.storage.DEFAULT_PART_SIZE)
+
+    with unittest.mock.patch("repkl.storage.MIN_PART_SIZE", 5 * 1024 * 1024):
+      with self.assertRaises(ValueError):
+        repkl.cli.main([
+          "--s3-endpoint",
+          self.server.endpoint,
+          "--part-size",
+          str(64 * 1024),
+          "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+          "s3://bucket/ov-imp"
+        ])
+
+    self.assertEqual(self.server.objects, {})
+
+  def test_failed_abort(self):
+    src = repkl.storage.LocalStorage(pathlib.Path("src/test/resources/imp/countdown"))
+    size = src.size("countdown-small.mxf")
+
+    s3 = self._storage(part_size=16 * 1024, concurrency=2)
+
+    self.server.fail_deletes = True
+
+    # the error of the transfer is raised rather than that of the abort
+
+    with unittest.mock.patch.object(src, "read_range", side_effect=RuntimeError("source failure")):
+      with self.assertRaises(RuntimeError):
+        s3.put_file("countdown-small.mxf", src, "countdown-small.mxf", size)
+
+    with self.assertRaises(RuntimeError):
+      with s3.open_write("data.bin", size) as fp:
+        fp.write(src.read_bytes("countdown-small.mxf"))
+        raise RuntimeError("source failure")
+
+    self.assertEqual(self.server.objects, {})
+
+  def test_connection_pool(self):
+    src = repkl.storage.LocalStorage(pathlib.Path("src/test/resources/imp/countdown"))
+    size = src.size("countdown-small.mxf")
+
+    s3 = self._storage(part_size=16 * 1024, concurrency=3)
+
+    for i in range(5):
+      s3.put_file(f"{i}.mxf", src, "countdown-small.mxf", size)
+      with s3.open_write(f"{i}.bin", size) as fp:
+        fp.write(src.read_bytes("countdown-small.mxf"))
+
+    # connections are reused across uploads
+    self.assertLessEqual(self.server.connections, 3)
+
+  def test_multipart_writer(self):
+    data = bytes(range(256)) * 1000
+
+    s3 = self._storage(part_size=10000, concurrency=2)
+    with s3.open_write("data.bin", len(data)) as fp:
+      for i in range(0, len(data), 3000):
+        fp.write(data[i:i + 3000])
+
+    self.assertEqual(self.server.completed, [26])
+    self.assertEqual(self.server.objects[("bucket", "delivery/data.bin")], data)
+
+  def test_cli_copy_to_s3(self):
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--s3-endpoint",
+      self.server.endpoint,
+      "--part-size",
+      str(64 * 1024),
+      "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      "s3://bucket/ov-imp"
+    ])
+
+    keys = {k for _, k in self.server.objects}
+    self.assertIn("ov-imp/ASSETMAP.xml", keys)
+    self.assertIn("ov-imp/countdown-small.mxf", keys)
+    self.assertIn("ov-imp/WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf", keys)
+
+  def test_cli_copy_from_s3(self):
+    src_dir = pathlib.Path("src/test/resources/imp/countdown-audio")
+    for p in src_dir.iterdir():
+      self.server.objects[("bucket", f"countdown-audio/{p.name}")] = p.read_bytes()
+
+    test_dir = pathlib.Path("build/s3-src-imp")
+    if test_dir.exists():
+      shutil.rmtree(test_dir)
+    test_dir.mkdir(parents=True)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--s3-endpoint",
+      self.server.endpoint,
+      "s3://bucket/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(test_dir)
+    ])
+
+    self.assertEqual(
+      test_dir.joinpath("countdown-small.mxf").read_bytes(),
+      src_dir.joinpath("countdown-small.mxf").read_bytes()
+    )
+
+class _StandInHTTPHandler(http.server.BaseHTTPRequestHandler):
+  # static files with support for single byte ranges
+
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args): # pylint: disable=redefined-builtin
+    pass
+
+  def _reply(self, status: int, body: bytes = b"", headers=None):
+    self.send_response(status)
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    if self.command != "HEAD":
+      self.wfile.write(body)
+
+  def do_HEAD(self):
+    self.do_GET()
+
+  def do_GET(self):
+    self.server.requests.append((self.command, self.path, self.headers.get("Range"), self.client_address))
+
+    path = self.server.root.joinpath(urllib.parse.unquote(self.path).lstrip("/"))
+
+    if not path.is_file():
+      self._reply(404)
+      return
+
+    data = path.read_bytes()
+
+    byte_range = self.headers.get("Range")
+    if byte_range is not None:
+      first, _, last = byte_range[len("bytes="):].partition("-")
+      first, last = int(first), min(int(last), len(data) - 1)
+      self._reply(206, data[first:last + 1], {"Content-Range": f"bytes {first}-{last}/{len(data)}"})
+    else:
+      self._reply(200, data)
+
+class StandInHTTPServer(http.server.ThreadingHTTPServer):
+
+  def __init__(self, root: pathlib.Path):
+    super().__init__(("127.0.0.1", 0), _StandInHTTPHandler)
+    self.root = root
+    self.requests = []
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server_address[1]}"
+
+class HTTPStorageTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = StandInHTTPServer(pathlib.Path("src/test/resources/imp"))
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _storage(self, **kwargs) -> repkl.storage.HTTPStorage:
+    storage = repkl.storage.HTTPStorage(f"{self.server.url}/countdown", **kwargs)
+    self.addCleanup(storage.close)
+    return storage
+
+  def test_read(self):
+    storage = self._storage()
+    data = pathlib.Path("src/test/resources/imp/countdown/ASSETMAP.xml").read_bytes()
+
+    self.assertEqual(storage.read_bytes("ASSETMAP.xml"), data)
+    self.assertEqual(storage.read_range("ASSETMAP.xml", 5, 10), data[5:15])
+    self.assertEqual(storage.size("ASSETMAP.xml"), len(data))
+
+    # requests are made over a single keep-alive connection
+    self.assertEqual(len({r[3] for r in self.server.requests}), 1)
+
+    with self.assertRaises(OSError):
+      storage.size("missing.mxf")
+
+  def test_download(self):
+    storage = self._storage(part_size=16 * 1024, concurrency=3)
+    data = pathlib.Path("src/test/resources/imp/countdown/countdown-small.mxf").read_bytes()
+
+    test_dir = pathlib.Path("build/http-download")
+    if test_dir.exists():
+      shutil.rmtree(test_dir)
+    test_dir.mkdir(parents=True)
+
+    dest = repkl.storage.LocalStorage(test_dir)
+    dest.put_file("countdown-small.mxf", storage, "countdown-small.mxf", len(data))
+
+    self.assertEqual(test_dir.joinpath("countdown-small.mxf").read_bytes(), data)
+    self.assertEqual(
+      len([r for r in self.server.requests if r[2] is not None]),
+      (len(data) + 16 * 1024 - 1) // (16 * 1024)
+    )
+
+    # parts are returned in order when the file is hashed as it is copied
+
+    digests = dest.put_file("copy.mxf", storage, "countdown-small.mxf", len(data), ["http://www.w3.org/2000/09/xmldsig#sha1"])
+
+    self.assertEqual(test_dir.joinpath("copy.mxf").read_bytes(), data)
+    self.assertEqual(digests["http://www.w3.org/2000/09/xmldsig#sha1"], "nVRLfBq+LuP4/aMrgSSg03XwnKg=")
+
+    # the server reports the size of the file with each part, which must match the expected size
+
+    with self.assertRaises(repkl.storage.HTTPError):
+      dest.put_file("resized.mxf", storage, "countdown-small.mxf", len(data) + 1)
+
+    with self.assertRaises(repkl.storage.HTTPError):
+      dest.put_file("resized.mxf", storage, "countdown-small.mxf", len(data) - 1, ["http://www.w3.org/2000/09/xmldsig#sha1"])
+
+  def test_cli_copy_from_http(self):
+    test_dir = pathlib.Path("build/http-src-imp")
+    if test_dir.exists():
+      shutil.rmtree(test_dir)
+    test_dir.mkdir(parents=True)
+
+    repkl.cli.main([
+      "--action",
+      "copy",
+      "--part-size",
+      str(16 * 1024),
+      "--delivery",
+      f"{self.server.url}/countdown-audio",
+      f"{self.server.url}/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+      str(test_dir)
+    ])
+
+    for name in ("countdown-small.mxf", "WAV_d01bc6be-ae2f-436b-9705-c402e1d92212.mxf"):
+      self.assertEqual(
+        test_dir.joinpath(name).read_bytes(),
+        pathlib.Path("src/test/resources/imp/countdown-audio").joinpath(name).read_bytes()
+      )
+
+  def test_connection_pool(self):
+    storage = self._storage(part_size=16 * 1024, concurrency=3)
+    size = storage.size("countdown-small.mxf")
+
+    test_dir = pathlib.Path("build/http-pool")
+    if test_dir.exists():
+      shutil.rmtree(test_dir)
+    test_dir.mkdir(parents=True)
+
+    dest = repkl.storage.LocalStorage(test_dir)
+
+    for i in range(10):
+      dest.put_file(f"{i}.mxf", storage, "countdown-small.mxf", size)
+
+    # connections are reused across files
+    self.assertLessEqual(len({r[3] for r in self.server.requests}), 3)
+
+  def test_cli_copy_to_http(self):
+    with self.assertRaises(ValueError):
+      repkl.cli.main([
+        "--action",
+        "copy",
+        "src/test/resources/imp/countdown-audio/CPL_0b976350-bea1-4e62-ba07-f32b28aaaf30.xml",
+        f"{self.server.url}/new_delivery"
+      ])